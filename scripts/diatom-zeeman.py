@@ -29,6 +29,10 @@ import diatom.hamiltonian as hamiltonian
 import diatom.calculate as calculate
 from diatom.constants import Rb87Cs133
 
+import sys
+sys.path.append('../scripts')
+import precompute_tools.operators as operators
+
 import scipy.constants
 
 import matplotlib.pyplot as plt
@@ -85,7 +89,7 @@ def itob(i):
 """
 
 # %%
-H0,Hz,Hdc,Hac = hamiltonian.build_hamiltonians(N_MAX, Rb87Cs133, zeeman=True, Edc=True, ac=True)
+H0,Hz,Hdc,Hac = operators.build_hamiltonians(N_MAX, Rb87Cs133, zeeman=True, Edc=True, ac=True)
 
 H = H0[..., None]+\
     Hz[..., None]*B+\
@@ -221,17 +225,17 @@ STATE_CMAP = plt.cm.gist_rainbow(np.linspace(0,1,len(CONSIDERED_STATE_POSITIONS)
 
 # %%
 # Plot Transition Dipole Moments
-dipole_op_pos = calculate.dipole(N_MAX,I1,I2,1,1)
+dipole_op_pos = operators.dipole(N_MAX,I1,I2,1,1)
 tdm_matrices_pos = (STATES[:, :, CONSIDERED_STATE_POSITIONS].conj().transpose(0, 2, 1) @ (dipole_op_pos @ STATES[:, :, CONSIDERED_STATE_POSITIONS])).real
 all_tdm_matrices_pos = (STATES[:, :, :].conj().transpose(0, 2, 1) @ (dipole_op_pos @ STATES[:, :, :])).real
 
 
-dipole_op_zero = calculate.dipole(N_MAX,I1,I2,1,0)
+dipole_op_zero = operators.dipole(N_MAX,I1,I2,1,0)
 tdm_matrices_zero = (STATES[:, :, CONSIDERED_STATE_POSITIONS].conj().transpose(0, 2, 1) @ (dipole_op_zero @ STATES[:, :, CONSIDERED_STATE_POSITIONS])).real
 all_tdm_matrices_zero = (STATES[:, :, :].conj().transpose(0, 2, 1) @ (dipole_op_zero @ STATES[:, :, :])).real
 
 
-dipole_op_neg = calculate.dipole(N_MAX,I1,I2,1,-1)
+dipole_op_neg = operators.dipole(N_MAX,I1,I2,1,-1)
 tdm_matrices_neg = (STATES[:, :, CONSIDERED_STATE_POSITIONS].conj().transpose(0, 2, 1) @ (dipole_op_neg @ STATES[:, :, CONSIDERED_STATE_POSITIONS])).real
 all_tdm_matrices_neg = (STATES[:, :, :].conj().transpose(0, 2, 1) @ (dipole_op_neg @ STATES[:, :, :])).real
 
@@ -534,7 +538,7 @@ fig.savefig('../images/10-state-zeeman.pdf')
 
 # %%
 polarisation=1
-dipole_op = calculate.dipole(N_MAX,I1,I2,1,polarisation)
+dipole_op = operators.dipole(N_MAX,I1,I2,1,polarisation)
 tdm_matrices = (STATES[:, :, CONSIDERED_STATE_POSITIONS].conj().transpose(0, 2, 1) @ (dipole_op @ STATES[:, :, CONSIDERED_STATE_POSITIONS])).real
 
 fig, ax = plt.subplots()
@@ -624,7 +628,7 @@ angular = ENERGIES[AT_B_NUM, CONSIDERED_STATE_POSITIONS].real / H_BAR
 driving = angular[intended_state_considered_index] - angular[initial_state_considered_index] + DETUNING
 
 # Construct Rabi coupling matrix
-dipole_op = calculate.dipole(N_MAX,I1,I2,D_0,POLARISATION)
+dipole_op = operators.dipole(N_MAX,I1,I2,D_0,POLARISATION)
 coupling = STATES[AT_B_NUM, :, CONSIDERED_STATE_POSITIONS].conj() @ dipole_op @ STATES[AT_B_NUM, :, CONSIDERED_STATE_POSITIONS].T
 rabi = (E_0/H_BAR) * coupling
 
@@ -712,7 +716,7 @@ angular = ENERGIES[:, CONSIDERED_STATE_POSITIONS].real / H_BAR # [B_Number, stat
 driving = angular[:, intended_state_considered_index].T - angular[:, initial_state_considered_index] + DETUNING # [B_Number]
 
 # Get Rabi coupling matrix for each B
-dipole_op = calculate.dipole(N_MAX,I1,I2,1,POLARISATION)
+dipole_op = operators.dipole(N_MAX,I1,I2,1,POLARISATION)
 couplings = STATES[:, :, CONSIDERED_STATE_POSITIONS].conj().transpose(0, 2, 1) @ (dipole_op @ STATES[:, :, CONSIDERED_STATE_POSITIONS])
 E_0 = np.abs((2*np.pi*H_BAR) / (D_0 * couplings[:, initial_state_considered_index, intended_state_considered_index] * PULSE_TIME))
 
@@ -983,7 +987,7 @@ def phase_fidelity(intended_state_label,T_STEPS=10000):
     driving = angular[:, intended_state_considered_index].T - angular[:, initial_state_considered_index] + DETUNING # [bi]
 
     # Get Rabi coupling matrix for each B
-    dipole_op = calculate.dipole(N_MAX,I1,I2,1,POLARISATION)
+    dipole_op = operators.dipole(N_MAX,I1,I2,1,POLARISATION)
     couplings = STATES[:, :, CONSIDERED_STATE_POSITIONS].conj().transpose(0, 2, 1) @ (dipole_op @ STATES[:, :, CONSIDERED_STATE_POSITIONS])
 
     # Get desired E field for each B and rabi frequency
@@ -34,6 +34,11 @@ import diatom.hamiltonian as hamiltonian
 import diatom.calculate as calculate
 from diatom.constants import *
 
+import sys
+sys.path.append('../scripts')
+from precompute_tools.eigen import real_if_symmetric
+import precompute_tools.operators as operators
+
 from tqdm import tqdm
 from numba import jit
 
@@ -186,7 +191,8 @@ def label_d_to_edge_indices(N,MF_D,d): # Returns the start indices of P=0,P=1,P=
 """
 
 # %%
-H0,Hz,Hdc,Hac = hamiltonian.build_hamiltonians(N_MAX, MOLECULE, zeeman=True, Edc=False, ac=False)
+H0,Hz,Hdc,Hac = operators.build_hamiltonians(N_MAX, MOLECULE, zeeman=True, Edc=False, ac=False)
+H0, Hz = real_if_symmetric(H0, Hz) # real for Zeeman only, so eigh takes the real path
 
 H = (
     +H0[..., None]
@@ -33,6 +33,12 @@ import diatom.hamiltonian as hamiltonian
 import diatom.calculate as calculate
 from diatom.constants import *
 
+import sys
+sys.path.append('../scripts')
+from precompute_tools.eigen import real_if_symmetric
+from precompute_tools.state_index import state_index, degeneracy
+import precompute_tools.operators as operators
+
 from matplotlib.pyplot import spy
 
 import scipy.constants
@@ -82,7 +88,8 @@ N_STATES = PER_MN * (N_MAX+1)**2
 """
 
 # %%
-H0,Hz,Hdc,Hac = hamiltonian.build_hamiltonians(N_MAX, MOLECULE, zeeman=True, Edc=False, ac=True)
+H0,Hz,Hdc,Hac = operators.build_hamiltonians(N_MAX, MOLECULE, zeeman=True, Edc=False, ac=True)
+H0, Hz = real_if_symmetric(H0, Hz) # real for Zeeman only, so eigh takes the real path
 
 H = (
     +H0[...,None]
@@ -103,33 +110,28 @@ ENERGIES, STATES, labels_d = calculate.sort_by_state(ENERGIES_RAW, STATES_RAW, N
 
 # %%
 def label_to_state_no(N,MF_D,k):
-    return np.where((LABELS_D[:, 0] == N) & (LABELS_D[:, 1] == MF_D) & (LABELS_D[:, 2] == k))[0][0]
+    return STATE_NO_OF_LABEL[(N,MF_D,k)]
 
 def state_no_to_uncoupled_label(state_no):
     return UNCOUPLED_LABELS_D[state_no]
 
 
 # %%
+STATE_INDEX = state_index(N_MAX, I1_D, I2_D)
+
 def label_degeneracy(N,MF_D):
-    # Want number of ways of having
-    # MF = MN + (M_I1 + M_I2) # NP-Hard Problem SSP (Subset Sum)
-    d=0
-    for MN in range(-N,N+1):
-        for M_I1_D in range(-I1_D,I1_D+1,2):
-            for M_I2_D in range(-I2_D,I2_D+1,2):
-                if 2*MN+M_I1_D+M_I2_D == MF_D:
-                    d+=1
-    return d
+    return degeneracy(STATE_INDEX, N, MF_D)
 
 
 # %%
 labels_d[:,1] *= 2 # Double MF to guarantee int
 LABELS_D=(np.rint(labels_d)).astype("int")
+STATE_NO_OF_LABEL = {label: i for i, label in enumerate(map(tuple, LABELS_D.tolist()))}
 
 # %%
-dipole_op_zero = calculate.dipole(N_MAX,I1,I2,1,0)
-dipole_op_minus = calculate.dipole(N_MAX,I1,I2,1,-1)
-dipole_op_plus = calculate.dipole(N_MAX,I1,I2,1,+1)
+dipole_op_zero = operators.dipole(N_MAX,I1,I2,1,0)
+dipole_op_minus = operators.dipole(N_MAX,I1,I2,1,-1)
+dipole_op_plus = operators.dipole(N_MAX,I1,I2,1,+1)
 
 # %% [markdown]
 """
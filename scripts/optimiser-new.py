@@ -44,6 +44,13 @@ from functools import partial
 
 from tqdm import tqdm, trange
 
+import sys
+sys.path.append('../scripts')
+from precompute_tools.cache import cached_store
+from precompute_tools.blocks import load_states
+from precompute_tools.state_index import state_index_from_store, degeneracy, node_index, edge_index
+from precompute_tools.moments import field_tolerance
+
 import itertools
 import math
 
@@ -100,7 +107,7 @@ GAUSS = 1e-4 # T
 
 # %%
 print("Loading precomputed data...")
-data = np.load(f'../precomputed/{settings_string}.npz')
+data = cached_store(MOLECULE_STRING, N_MAX) # computed on first use
 
 B=data['b']
 B_MIN = B[0]
@@ -108,7 +115,7 @@ B_MAX = B[-1]
 B_STEPS = len(B)
 
 ENERGIES = data['energies']
-STATES = data['states']
+STATES = load_states(data) # dense or block-sparse, STATES[b] is always dense
 
 UNCOUPLED_LABELS_D=data['uncoupled_labels_d']
 
@@ -122,6 +129,8 @@ EDGE_JUMP_LIST = data['edge_jump_list']
 
 
 MAGNETIC_MOMENTS=data['magnetic_moments'] 
+# dmu/dB from perturbation theory, see load_store for older stores
+MAGNETIC_MOMENT_SLOPES = data['magnetic_moment_slopes'] if 'magnetic_moment_slopes' in data else np.gradient(MAGNETIC_MOMENTS.real, B, axis=1)
 
 COUPLINGS_SPARSE=data['couplings_sparse']
 TRANSITION_GATE_TIMES_POL = data['transition_gate_times_pol']
@@ -135,12 +144,14 @@ PREDECESSOR_UNPOL = data['predecessor_unpol_time_from_initials']
 
 PAIR_RESONANCE = data['pair_resonance']
 
+STATE_INDEX = state_index_from_store(data)
+
 def label_degeneracy(N,MF_D):
-    return LABELS_DEGENERACY[N,(MF_D+F_D_MAX)//2]
+    return degeneracy(STATE_INDEX, N, MF_D)
 
 @jit(nopython=True)
 def label_d_to_node_index(N,MF_D,d):
-    return STATE_JUMP_LIST[N,(MF_D+F_D_MAX)//2]+d
+    return node_index(STATE_INDEX, N, MF_D, d)
 
 @jit(nopython=True)
 def label_d_to_edge_indices(N,MF_D,d): # Returns the start indices of P=0,P=1,P=2, and the next edge
@@ -227,9 +238,7 @@ def round_to_n(x, n):
 # %%
 @jit(nopython=True)
 def label_pair_to_edge_index(label1,label2):
-    first_indices = label_d_to_edge_indices(label1[0],label1[1],label1[2])
-    section = 3*((label2[0] - label1[0]) < 0) + [0,1,2][(label2[0] - label1[0])*(label1[1] - label2[1])//2]
-    return first_indices[section]+label2[2]
+    return edge_index(STATE_INDEX, label1, label2)
 
 # TRANSITION_LABELS_D[label_pair_to_edge_index((1,4,3),(0,2,1))]
 TRANSITION_LABELS_D[label_pair_to_edge_index(np.array([1,4,3]),np.array([0,2,1]))]
@@ -484,23 +493,31 @@ def maximise_fid_dev(possibilities, progress_proxy, max_bi=B_STEPS, loop=False,
                 
         # Find Delta B to get 9's fidelity
         all_moments = MAGNETIC_MOMENTS[desired_indices,:].real
+        all_slopes = MAGNETIC_MOMENT_SLOPES[desired_indices,:]
         this_deviation = np.empty((B_STEPS),dtype=np.double)
+        this_slope_deviation = np.empty((B_STEPS),dtype=np.double)
         for bi in range(B_STEPS):
             max_here = all_moments[0,bi]
             min_here = all_moments[0,bi]
+            max_slope_here = all_slopes[0,bi]
+            min_slope_here = all_slopes[0,bi]
             for lsi in range(1,n_states):
                 this_moment = all_moments[lsi,bi]
                 if this_moment > max_here:
                     max_here=this_moment    
                 if this_moment < min_here:
                     min_here=this_moment
+                max_slope_here = max(max_slope_here, all_slopes[lsi,bi])
+                min_slope_here = min(min_slope_here, all_slopes[lsi,bi])
             this_deviation[bi] = max_here-min_here
+            this_slope_deviation[bi] = max_slope_here-min_slope_here
 
-        this_delta_b_req_unpol = scipy.constants.h/(this_deviation*this_unpol_t_gate)
-        this_delta_b_req_pol = scipy.constants.h/(this_deviation*this_pol_t_gate)
+        # The moment spread alone allows any Delta B where the moments cross; their slopes bound it there
+        this_delta_b_req_unpol = field_tolerance(this_deviation, this_slope_deviation, scipy.constants.h/this_unpol_t_gate)
+        this_delta_b_req_pol = field_tolerance(this_deviation, this_slope_deviation, scipy.constants.h/this_pol_t_gate)
         
         # Rank this state combination
-        rated_b_max = (np.minimum(np.ones(B_STEPS),scipy.constants.h/(this_deviation*(pol_eff*this_pol_t_gate + (1-pol_eff)*this_unpol_t_gate))))**(dev_exp)
+        rated_b_max = (np.minimum(np.ones(B_STEPS),field_tolerance(this_deviation, this_slope_deviation, scipy.constants.h/(pol_eff*this_pol_t_gate + (1-pol_eff)*this_unpol_t_gate))))**(dev_exp)
         
         rated_time = (  (travel_frac)           * (pol_eff*this_pol_distance_time + (1-pol_eff)*this_unpol_distance_time)
                       +(1-travel_frac)*n_states * (pol_eff*this_pol_t_gate        + (1-pol_eff)*this_unpol_t_gate)
@@ -900,8 +917,10 @@ desired_indices = [label_d_to_node_index(*label) for label in states]
 
 
 # Find best B for minimum dipole deviation
-all_moments = MAGNETIC_MOMENTS[:,desired_indices]
-this_deviation = np.abs((np.amax(all_moments,axis=1) - np.amin(all_moments,axis=1)))
+all_moments = MAGNETIC_MOMENTS[desired_indices,:].real
+all_slopes = MAGNETIC_MOMENT_SLOPES[desired_indices,:]
+this_deviation = np.amax(all_moments,axis=0) - np.amin(all_moments,axis=0)
+this_slope_deviation = np.amax(all_slopes,axis=0) - np.amin(all_slopes,axis=0)
 
 DESIRED_FIDELITY = 0.999
 
@@ -969,8 +988,8 @@ for from_label, to_label in zip(states, states[1:]):
     t_required_max_pol = np.maximum(t_required_max_up_pol,t_required_max_down_pol)
     t_required_global_max_pol = np.maximum(t_required_max_pol,t_required_global_max_pol)
     
-delta_b_required_unpol = (scipy.constants.h) / (this_deviation * t_required_global_max_unpol)
-delta_b_required_pol = (scipy.constants.h) / (this_deviation * t_required_global_max_pol)
+delta_b_required_unpol = field_tolerance(this_deviation, this_slope_deviation, scipy.constants.h / t_required_global_max_unpol)
+delta_b_required_pol = field_tolerance(this_deviation, this_slope_deviation, scipy.constants.h / t_required_global_max_pol)
 
 
 # %%
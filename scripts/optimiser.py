@@ -30,6 +30,10 @@ import diatom.hamiltonian as hamiltonian
 import diatom.calculate as calculate
 from diatom.constants import *
 
+import sys
+sys.path.append('../scripts')
+from precompute_tools.state_index import state_index, degeneracy
+
 import scipy.constants
 from scipy.sparse import csgraph
 
@@ -149,8 +153,10 @@ print("Precomuted data loaded.")
 
 
 # %%
+STATE_NO_OF_LABEL = {label: i for i, label in enumerate(map(tuple, LABELS_D.tolist()))}
+
 def label_to_state_no(N,MF_D,k):
-    return np.where((LABELS_D[:, 0] == N) & (LABELS_D[:, 1] == MF_D) & (LABELS_D[:, 2] == k))[0][0]
+    return STATE_NO_OF_LABEL[(N,MF_D,k)]
 
 def state_no_to_uncoupled_label(state_no):
     return UNCOUPLED_LABELS_D[state_no]
@@ -187,16 +193,10 @@ def label_d_to_latex_string(label_d):
 
 
 # %%
+STATE_INDEX = state_index(N_MAX, I1_D, I2_D)
+
 def label_degeneracy(N,MF_D):
-    # Want number of ways of having
-    # MF = MN + (M_I1 + M_I2) # NP-Hard Problem SSP (Subset Sum)
-    d=0
-    for MN in range(-N,N+1):
-        for M_I1_D in range(-I1_D,I1_D+1,2):
-            for M_I2_D in range(-I2_D,I2_D+1,2):
-                if 2*MN+M_I1_D+M_I2_D == MF_D:
-                    d+=1
-    return d
+    return degeneracy(STATE_INDEX, N, MF_D)
 
 
 # %%
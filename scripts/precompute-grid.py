@@ -0,0 +1,199 @@
+# ---
+# jupyter:
+#   jupytext:
+#     cell_markers: '"""'
+#     formats: notebooks//ipynb,scripts//py:percent
+#     text_representation:
+#       extension: .py
+#       format_name: percent
+#       format_version: '1.3'
+#       jupytext_version: 1.14.1
+#   kernelspec:
+#     display_name: Python 3 (ipykernel)
+#     language: python
+#     name: python3
+# ---
+
+# %% [markdown]
+"""
+# This file pre-computes the transition tables over a grid of magnetic field, DC electric field and trap light
+"""
+
+# %% [markdown]
+"""
+## Import appropriate modules
+"""
+
+# %%
+import numpy as np
+
+import diatom.constants
+from diatom.constants import *
+
+import sys
+sys.path.append('../scripts')
+from precompute_tools.eigen import real_if_symmetric, uncoupled_labels_d, mf_blocks, check_block_diagonal, off_block_max
+from precompute_tools.state_index import state_index, node_index
+from precompute_tools.couplings import edge_polarisations
+from precompute_tools.light import polarisation_terms, polarisation_coefficients
+from precompute_tools.grid import label_start, create_grid_tables, run_grid
+from precompute_tools.config import grid_arguments, parse_b_grid
+from precompute_tools.store import chunk_steps_for_memory, save_store, load_store
+from precompute_tools.scheduler import available_cores
+import precompute_tools.operators as operators
+
+# %%
+import matplotlib.pyplot as plt
+plt.rcParams["font.family"] = 'sans-serif'
+plt.rcParams["figure.autolayout"] = True
+plt.rcParams['figure.figsize'] = (4, 3.5)
+plt.rcParams['figure.dpi'] = 200
+
+# %matplotlib widget
+# %config InlineBackend.figure_format = 'retina'
+
+# %% [markdown]
+"""
+## Defining parameters
+"""
+
+# %%
+# Defaults live in precompute_tools.config; override from the command line, e.g.
+#   python precompute-grid.py --n-max 2 --b-grid 0.001:1000:10 --e-grid 0:5:0.25 --tile 16 64
+#   python precompute-grid.py --e-grid 0:1:1 --intensity-grid 0:5:0.5 --angle-grid 0:90:10
+ARGS = grid_arguments()
+
+MOLECULE_STRING = ARGS.molecule
+MOLECULE = getattr(diatom.constants, MOLECULE_STRING)
+N_MAX = ARGS.n_max
+
+GAUSS = 1e-4 # T
+KV_PER_CM = 1e5 # V/m
+KW_PER_CM2 = 1e7 # W/m^2
+B = parse_b_grid(ARGS.b_grid) * GAUSS
+E = parse_b_grid(ARGS.e_grid) * KV_PER_CM
+INTENSITY = parse_b_grid(ARGS.intensity_grid) * KW_PER_CM2
+ANGLE = np.deg2rad(parse_b_grid(ARGS.angle_grid))
+
+settings_string = f'{MOLECULE_STRING}NMax{N_MAX}Grid'
+OUTPUT_DIR = ARGS.output or f'../precomputed/{settings_string}'
+
+I1 = MOLECULE["I1"]
+I2 = MOLECULE["I2"]
+I1_D = round(2*MOLECULE["I1"])
+I2_D = round(2*MOLECULE["I2"])
+
+# %% [markdown]
+"""
+## Canonical labels, edges and Hamiltonians
+Exactly as in precompute. A DC field along z conserves M_F, so the same blocks apply; trap light only does when
+it is polarised along B, and rows at any other angle are followed as one block.
+"""
+
+# %%
+UNCOUPLED_LABELS_D = uncoupled_labels_d(N_MAX, I1_D, I2_D)
+STATE_INDEX = state_index(N_MAX, I1_D, I2_D)
+N_STATES = len(STATE_INDEX.labels_d)
+N_TRANSITIONS = len(STATE_INDEX.edge_indices)
+
+INITIAL_STATE_INDICES = [node_index(STATE_INDEX, *label_d) for label_d in MOLECULE["StartStates_D"]]
+
+# %%
+H0,Hz,Hdc,Hac = operators.build_hamiltonians(N_MAX, MOLECULE, zeeman=True, Edc=True, ac=False)
+H0, Hz, Hdc = real_if_symmetric(H0, Hz, Hdc)
+
+_, UNCOUPLED_BLOCKS = mf_blocks(UNCOUPLED_LABELS_D)
+for matrix in (H0, Hz, Hdc):
+    check_block_diagonal(matrix, UNCOUPLED_BLOCKS)
+
+# %%
+# Hac per unit intensity at three polarisation angles spans every angle, see precompute_tools.light
+if np.any(INTENSITY != 0):
+    HAC_AT = [operators.build_hamiltonians(N_MAX, {**MOLECULE, 'Beta': beta}, zeeman=False, Edc=False, ac=True)[3]
+              for beta in (0, np.pi/4, np.pi/2)]
+    HAC_TERMS = list(real_if_symmetric(*polarisation_terms(*HAC_AT)))
+else:
+    HAC_TERMS = [np.zeros_like(H0)]*3
+
+# Every (E, intensity, angle) is one row of the grid, H0 + E*Hdc + sum_k c_k HAC_TERMS[k] + B*Hz
+ROW_SHAPE = (len(E), len(INTENSITY), len(ANGLE))
+E_ROW, INTENSITY_ROW, ANGLE_ROW = (axis.ravel() for axis in np.meshgrid(E, INTENSITY, ANGLE, indexing='ij'))
+ROW_TERMS = [Hdc, *HAC_TERMS]
+ROW_COEFFICIENTS = np.concatenate([E_ROW[:, None], polarisation_coefficients(INTENSITY_ROW, ANGLE_ROW)], axis=1)
+
+DIPOLE_OPS = {p: operators.dipole(N_MAX,I1,I2,1,p) for p in (0, +1, -1)}
+
+# %% [markdown]
+"""
+## Sweep the grid
+Label once at zero E and light at B[0]. Each row follows the states out to its own (E, intensity, angle) and then
+along B by continuation, in its own process and in chunks of `CHUNK_STEPS` fields, writing into tiles of `ARGS.tile`
+(row, B) points so that cuts along either axis read back quickly. Eigenvectors are not kept.
+"""
+
+# %%
+STATES_START = label_start(H0, Hz, B[0], UNCOUPLED_BLOCKS, UNCOUPLED_LABELS_D, STATE_INDEX.labels_d)
+
+TABLES = create_grid_tables(OUTPUT_DIR, N_STATES, N_TRANSITIONS, len(ROW_COEFFICIENTS), len(B), ARGS.tile)
+THREADS = ARGS.threads or available_cores()
+WORKERS = ARGS.workers or THREADS
+CHUNK_STEPS = chunk_steps_for_memory(N_STATES, ARGS.memory / WORKERS)
+
+ROW_FALLBACKS = run_grid({
+    'H0': H0, 'Hz': Hz, 'b': B,
+    'terms': ROW_TERMS, 'coefficients': ROW_COEFFICIENTS,
+    'terms_conserve_mf': [off_block_max(term, UNCOUPLED_BLOCKS) == 0 for term in ROW_TERMS],
+    'blocks': UNCOUPLED_BLOCKS, 'states_start': STATES_START, 'path_steps': ARGS.path_steps,
+    'dipole_ops': DIPOLE_OPS,
+    'edge_polarisation': edge_polarisations(STATE_INDEX.edge_jump_list),
+    'index': STATE_INDEX, 'initial_state_indices': INITIAL_STATE_INDICES,
+    'chunk_steps': CHUNK_STEPS, 'directory': OUTPUT_DIR,
+    'table_shapes': {name: table.shape for name, table in TABLES.items()},
+}, workers=WORKERS, threads=THREADS)
+
+print(f"Continuation fell back to a full diagonalisation for {ROW_FALLBACKS.sum()} (field, block) pairs")
+
+# %% [markdown]
+"""
+# Save to files
+"""
+
+# %%
+save_store(OUTPUT_DIR,
+           metadata = {'molecule': MOLECULE_STRING, 'n_max': N_MAX, 'row_axes': ['e', 'intensity', 'angle'],
+                       'row_shape': list(ROW_SHAPE)},
+           b = B,
+           e = E,
+           intensity = INTENSITY,
+           angle = ANGLE,
+
+           uncoupled_labels_d = UNCOUPLED_LABELS_D,
+
+           labels_d = STATE_INDEX.labels_d,
+           labels_degeneracy = STATE_INDEX.degeneracy,
+           state_jump_list = STATE_INDEX.state_jump_list,
+
+           transition_labels_d = STATE_INDEX.edge_labels_d,
+           transition_indices = STATE_INDEX.edge_indices,
+           edge_jump_list = STATE_INDEX.edge_jump_list,
+
+           **TABLES,
+           )
+
+# %% [markdown]
+"""
+# How to load file
+Every table is a `TiledArray` indexed [..., row, b], with the rows in C order over `row_shape` (E, intensity, angle);
+a cut along either axis only reads the tiles it crosses.
+"""
+
+# %%
+data = load_store(OUTPUT_DIR)
+energies_loaded = data['energies']
+E_ROWS = slice(0, None, len(INTENSITY)*len(ANGLE)) # rows (E, intensity 0, angle 0)
+fig,ax = plt.subplots()
+ax.plot(E/KV_PER_CM, energies_loaded[E_ROWS, 0][:32].T)
+ax.set_xlabel('E (kV/cm)')
+fig,ax = plt.subplots()
+ax.plot(B/GAUSS, energies_loaded[0, :][:32].T)
+ax.set_xlabel('B (G)');
@@ -0,0 +1 @@
+"""Helpers shared by the precompute notebook/script and its consumers."""
@@ -0,0 +1,107 @@
+"""Run precompute or the appendix optimiser for several molecules at once.
+
+Each configuration runs as its own process with its BLAS, OpenMP and numba
+thread counts pinned to a per-job budget, so concurrent jobs share the
+machine instead of oversubscribing it. Run from the scripts directory:
+
+    python -m precompute_tools.batch precompute --n-max 2 --jobs 5 --threads-per-job 2
+    python -m precompute_tools.batch appendix --molecules Rb87Cs133 K40Rb87
+"""
+import argparse
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import DEFAULT_B_GRID
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APPENDIX_MOLECULES = ["Rb87Cs133", "K40Rb87", "Na23K40", "Na23Rb87", "Na23Cs133"]
+
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                    'NUMEXPR_NUM_THREADS', 'NUMBA_NUM_THREADS']
+
+
+def inherited_threads():
+    """Thread budget `run_job` started this process with, otherwise the cores it may run on."""
+    for name in THREAD_VARIABLES:
+        if os.environ.get(name, '').isdigit():
+            return int(os.environ[name])
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+
+def thread_environment(threads):
+    """Copy of the environment with every threading library limited to `threads`."""
+    env = dict(os.environ)
+    for name in THREAD_VARIABLES:
+        env[name] = str(threads)
+    env.setdefault('MPLBACKEND', 'Agg')
+    return env
+
+
+def run_job(name, command, threads, log_dir):
+    """Run one job to completion, logging its output to `log_dir/name.log`."""
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f'{name}.log')
+    with open(log_path, 'w') as log:
+        completed = subprocess.run(command, cwd=SCRIPTS_DIR, env=thread_environment(threads),
+                                   stdout=log, stderr=subprocess.STDOUT)
+    return name, completed.returncode, log_path
+
+
+def run_jobs(jobs, n_jobs, threads, log_dir):
+    """Run (name, command) pairs `n_jobs` at a time; returns the names of failed jobs."""
+    failed = []
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(run_job, name, command, threads, log_dir) for name, command in jobs]
+        for future in futures:
+            name, returncode, log_path = future.result()
+            status = 'done' if returncode == 0 else f'FAILED ({returncode})'
+            print(f"{name}: {status}, log in {log_path}")
+            if returncode != 0:
+                failed.append(name)
+    return failed
+
+
+def precompute_jobs(args, threads):
+    for molecule in args.molecules:
+        for n_max in args.n_max:
+            command = [sys.executable, 'precompute.py', '--molecule', molecule, '--n-max', str(n_max),
+                       '--b-grid', args.b_grid, '--threads', str(threads), '--memory', str(args.memory)]
+            yield f'precompute-{molecule}NMax{n_max}', command
+
+
+def appendix_jobs(args, threads):
+    for molecule in args.molecules:
+        for n_max in args.n_max:
+            command = [sys.executable, 'optimiser-appendix.py', '--molecule', molecule, '--n-max', str(n_max)]
+            yield f'appendix-{molecule}NMax{n_max}', command
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('task', choices=['precompute', 'appendix'])
+    parser.add_argument('--molecules', nargs='+', default=APPENDIX_MOLECULES)
+    parser.add_argument('--n-max', nargs='+', type=int, default=[2])
+    parser.add_argument('--b-grid', default=DEFAULT_B_GRID, help="field grid in gauss as start:stop:step,...")
+    parser.add_argument('--memory', type=float, default=4e9, help="working memory in bytes per precompute chunk")
+    parser.add_argument('--jobs', type=int, default=None, help="configurations to run at once")
+    parser.add_argument('--threads-per-job', type=int, default=None, help="BLAS/numba threads given to each job")
+    parser.add_argument('--log-dir', default='../precomputed/logs')
+    args = parser.parse_args(argv)
+
+    n_configurations = len(args.molecules)*len(args.n_max)
+    cores = os.cpu_count()
+    n_jobs = args.jobs or min(n_configurations, cores)
+    threads = args.threads_per_job or max(1, cores//n_jobs)
+
+    jobs = precompute_jobs(args, threads) if args.task == 'precompute' else appendix_jobs(args, threads)
+    log_dir = os.path.join(SCRIPTS_DIR, args.log_dir)
+    failed = run_jobs(list(jobs), n_jobs, threads, log_dir)
+    if failed:
+        sys.exit(f"{len(failed)} job(s) failed: {', '.join(failed)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import numpy as np
+
+from .eigen import mf_d_of_uncoupled
+
+
+class BlockLayout:
+    """Block-sparse layout of the eigenvector matrices.
+
+    M_F is conserved, so eigenvector i only has components on the uncoupled
+    basis states sharing its M_F. Block k pairs those basis rows with the
+    canonical columns of that M_F into a dense square matrix, and a field's
+    eigenvectors are stored as all the blocks flattened one after another:
+    sum(m_k^2) values instead of S^2.
+    """
+
+    def __init__(self, rows, columns, offsets):
+        self.rows = np.asarray(rows)
+        self.columns = np.asarray(columns)
+        self.offsets = np.asarray(offsets)
+        self.n_states = len(self.rows)
+        self.sizes = np.diff(self.offsets)
+        self.value_offsets = np.concatenate([[0], np.cumsum(self.sizes**2)])
+        self.n_values = int(self.value_offsets[-1])
+
+        self.block_of_column = np.empty(self.n_states, dtype=int)
+        self.position_of_column = np.empty(self.n_states, dtype=int)
+        for k in range(len(self.sizes)):
+            cols = self.columns[self.offsets[k]:self.offsets[k+1]]
+            self.block_of_column[cols] = k
+            self.position_of_column[cols] = np.arange(len(cols))
+
+    @classmethod
+    def from_labels(cls, uncoupled_labels_d, labels_d):
+        """Layout for eigenvectors over `uncoupled_labels_d` rows in the canonical `labels_d` column order."""
+        row_mf_d = mf_d_of_uncoupled(uncoupled_labels_d)
+        column_mf_d = np.asarray(labels_d)[:, 1]
+        mf_d_values = np.unique(column_mf_d)
+        rows = [np.flatnonzero(row_mf_d == mf_d) for mf_d in mf_d_values]
+        columns = [np.flatnonzero(column_mf_d == mf_d) for mf_d in mf_d_values]
+        if any(len(r) != len(c) for r, c in zip(rows, columns)):
+            raise ValueError("every M_F block needs as many basis states as eigenstates")
+        offsets = np.concatenate([[0], np.cumsum([len(r) for r in rows])])
+        return cls(np.concatenate(rows), np.concatenate(columns), offsets)
+
+    @classmethod
+    def from_store(cls, store):
+        return cls(store['states_block_rows'], store['states_block_columns'], store['states_block_offsets'])
+
+    def arrays(self):
+        """Arrays to save next to the block values, for `from_store`."""
+        return {'states_block_rows': self.rows, 'states_block_columns': self.columns,
+                'states_block_offsets': self.offsets}
+
+    def _rows(self, k):
+        return self.rows[self.offsets[k]:self.offsets[k+1]]
+
+    def _columns(self, k):
+        return self.columns[self.offsets[k]:self.offsets[k+1]]
+
+    def block(self, values, k):
+        """[b, row, column] view of block k of B x n_values block values."""
+        m = self.sizes[k]
+        return values[..., self.value_offsets[k]:self.value_offsets[k+1]].reshape(values.shape[:-1] + (m, m))
+
+    def compress(self, states, out=None):
+        """B x n_values block values of dense B x S x S eigenvectors [b,uncoupled,coupled]."""
+        if out is None:
+            out = np.empty(states.shape[:-2] + (self.n_values,), dtype=states.dtype)
+        for k in range(len(self.sizes)):
+            self.block(out, k)[...] = states[..., self._rows(k)[:, None], self._columns(k)[None, :]]
+        return out
+
+    def expand(self, values):
+        """Dense B x S x S eigenvectors [b,uncoupled,coupled] from block values."""
+        states = np.zeros(values.shape[:-1] + (self.n_states, self.n_states), dtype=values.dtype)
+        for k in range(len(self.sizes)):
+            states[..., self._rows(k)[:, None], self._columns(k)[None, :]] = self.block(values, k)
+        return states
+
+    def magnetic_moments(self, values, Hz):
+        """S x B expectation of -Hz in every eigenstate, one block at a time."""
+        values = np.asarray(values)
+        moments = np.empty((self.n_states, values.shape[0]), dtype=np.result_type(values, Hz))
+        for k in range(len(self.sizes)):
+            rows = self._rows(k)
+            v = self.block(values, k)
+            moments[self._columns(k)] = np.einsum('bji,jk,bki->ib', v.conj(), -Hz[np.ix_(rows, rows)], v, optimize='optimal')
+        return moments
+
+    def edge_couplings(self, values, dipole_ops, edge_indices, edge_polarisation):
+        """E x B real part of <i|d_p|j> along each edge, as `couplings.edge_couplings`, from block values.
+
+        Edges are grouped by (from block, to block, polarisation) so that each
+        group needs only the dipole operator between two blocks.
+        """
+        values = np.asarray(values)
+        couplings = np.zeros((len(edge_indices), values.shape[0]), dtype=np.double)
+        block_from = self.block_of_column[edge_indices[:, 0]]
+        block_to = self.block_of_column[edge_indices[:, 1]]
+        n_blocks = len(self.sizes)
+        groups = (block_from*n_blocks + block_to)*3 + (np.asarray(edge_polarisation) + 1)
+        for group in np.unique(groups):
+            edges = np.flatnonzero(groups == group)
+            k_from, k_to, p = block_from[edges[0]], block_to[edges[0]], edge_polarisation[edges[0]]
+            dipole = np.asarray(dipole_ops[p])[np.ix_(self._rows(k_from), self._rows(k_to))]
+            v_from = self.block(values, k_from)[:, :, self.position_of_column[edge_indices[edges, 0]]]
+            v_to = self.block(values, k_to)[:, :, self.position_of_column[edge_indices[edges, 1]]]
+            couplings[edges] = np.einsum('bre,rs,bse->eb', v_from.conj(), dipole, v_to, optimize='optimal').real
+        return couplings
+
+
+class BlockStates:
+    """Block-stored eigenvectors that index like the dense [b,uncoupled,coupled] STATES array."""
+
+    def __init__(self, layout, values):
+        self.layout = layout
+        self.values = values
+        self.shape = (values.shape[0], layout.n_states, layout.n_states)
+        self.dtype = values.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, b):
+        return self.layout.expand(np.asarray(self.values[b]))
+
+
+def load_states(store):
+    """The eigenvectors of a store, dense or block-sparse, indexable by field as STATES[b]."""
+    if 'states' in store:
+        return store['states']
+    return BlockStates(BlockLayout.from_store(store), store['states_blocks'])
@@ -0,0 +1,149 @@
+"""Content-addressed cache of precomputed stores.
+
+Entries live in ../precomputed/cache/<key>/, where the key hashes everything
+the tables depend on: the molecular constants, N_MAX, the field grid and the
+source of `pipeline`, the tools it imports and the diatom Hamiltonian code.
+Changing any of them gives a new key instead of silently reusing a stale store.
+"""
+import ast
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from .batch import SCRIPTS_DIR, inherited_threads, run_job
+from .config import DEFAULT_B_GRID, parse_b_grid
+from .store import MANIFEST_NAME, load_store
+
+CACHE_DIR = os.path.join(SCRIPTS_DIR, '..', 'precomputed', 'cache')
+CACHE_BUDGET = 100e9 # bytes
+ENTRY_NAME = 'cache.json'
+
+# Modules that only orchestrate and never change the numbers
+_NOT_HASHED = {'__init__.py', 'batch.py', 'cache.py', 'scheduler.py'}
+
+
+def _imported_tools(name, seen):
+    """Add `name` and the precompute_tools modules it imports, recursively, to `seen`."""
+    seen.add(name)
+    with open(os.path.join(SCRIPTS_DIR, 'precompute_tools', name), 'rb') as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.level == 1:
+            modules = [node.module] if node.module else [alias.name for alias in node.names]
+            for module in modules:
+                imported = module.split('.')[0] + '.py'
+                if imported not in seen:
+                    _imported_tools(imported, seen)
+    return seen
+
+
+def code_version():
+    """Hash of every source file that can change the precomputed numbers."""
+    import diatom.calculate
+    import diatom.hamiltonian
+
+    paths = [os.path.join(SCRIPTS_DIR, 'precompute_tools', name)
+             for name in sorted(_imported_tools('pipeline.py', set()) - _NOT_HASHED)]
+    paths += [inspect.getsourcefile(diatom.hamiltonian), inspect.getsourcefile(diatom.calculate)]
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def cache_key(molecule_string, n_max, b_grid=DEFAULT_B_GRID):
+    """Key of the store for these inputs, and the inputs it was built from."""
+    import diatom.constants
+
+    molecule = getattr(diatom.constants, molecule_string)
+    inputs = {
+        'molecule': molecule_string,
+        'constants': json.loads(json.dumps(molecule, sort_keys=True, default=str)),
+        'n_max': n_max,
+        'b_grid': b_grid,
+        'code_version': code_version(),
+    }
+    digest = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(parse_b_grid(b_grid)).tobytes())
+    return digest.hexdigest()[:24], inputs
+
+
+def _entry_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def _entries(cache_dir):
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name, ENTRY_NAME)
+        if os.path.exists(entry):
+            yield name, os.path.getmtime(entry)
+
+
+def evict(cache_dir=CACHE_DIR, budget_bytes=CACHE_BUDGET, keep=()):
+    """Delete least recently used entries until the cache fits in budget_bytes."""
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = sorted(_entries(cache_dir), key=lambda entry: entry[1])
+    sizes = {name: _entry_size(os.path.join(cache_dir, name)) for name, _ in entries}
+    total = sum(sizes.values())
+    evicted = []
+    for name, _ in entries:
+        if total <= budget_bytes:
+            break
+        if name in keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        total -= sizes[name]
+        evicted.append(name)
+    return evicted
+
+
+def cached_store(molecule_string, n_max, b_grid=DEFAULT_B_GRID, compute=True, cache_dir=CACHE_DIR,
+                 budget_bytes=CACHE_BUDGET, threads=None, mmap_mode='r'):
+    """Precomputed store for these parameters, computing it first on a miss.
+
+    Args:
+        molecule_string (str): name of the molecule in diatom.constants
+        n_max (int): highest rotational level in the basis
+        b_grid (str): field grid in gauss as start:stop:step,...
+        compute (bool): run precompute on a miss, otherwise raise FileNotFoundError
+        budget_bytes (float): evict least recently used entries beyond this
+        threads (int): thread budget for an on-demand precompute (default: the one this
+            process runs under, so a miss inside a batch job stays within its share)
+    Returns:
+        store (Store): memory-mapped store, see `store.load_store`
+    """
+    key, inputs = cache_key(molecule_string, n_max, b_grid)
+    path = os.path.join(cache_dir, key)
+    entry = os.path.join(path, ENTRY_NAME)
+
+    if not os.path.exists(entry):
+        if not compute:
+            raise FileNotFoundError(f"no cached store for {molecule_string} N_MAX={n_max} ({key})")
+        print(f"Cache miss for {molecule_string} N_MAX={n_max}, precomputing into {path}")
+        partial = f'{path}.partial-{os.getpid()}'
+        threads = threads or inherited_threads()
+        command = [sys.executable, '-m', 'precompute_tools.pipeline', '--molecule', molecule_string, '--n-max', str(n_max),
+                   '--b-grid', b_grid, '--threads', str(threads), '--output', partial]
+        _, returncode, log_path = run_job(f'cache-{key}', command, threads, os.path.join(cache_dir, 'logs'))
+        if returncode != 0 or not os.path.exists(os.path.join(partial, MANIFEST_NAME)):
+            shutil.rmtree(partial, ignore_errors=True)
+            raise RuntimeError(f"precompute failed for {molecule_string} N_MAX={n_max}, see {log_path}")
+        with open(os.path.join(partial, ENTRY_NAME), 'w') as f:
+            json.dump({'key': key, 'created': time.time(), **inputs}, f, indent=1)
+        try:
+            os.rename(partial, path)
+        except OSError:
+            # Another process filled the same entry first
+            shutil.rmtree(partial, ignore_errors=True)
+        evict(cache_dir, budget_bytes, keep={key})
+
+    os.utime(entry) # mark as recently used
+    return load_store(path, mmap_mode=mmap_mode)
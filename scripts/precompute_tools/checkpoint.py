@@ -0,0 +1,95 @@
+"""Resume an interrupted precompute from its last completed chunk.
+
+Every output table is already a memory-mapped file in the store directory,
+so all a restart needs is how far each stage got, plus the few arrays that
+live only in memory between chunks (the full precision eigenvectors each
+segment continues from). `checkpoint.json` holds the former and one `.npz`
+per segment the latter; both are replaced atomically after the chunk's
+outputs are flushed, so a crash at any point loses at most one chunk.
+"""
+import json
+import os
+
+import numpy as np
+
+CHECKPOINT_NAME = 'checkpoint.json'
+
+
+def _replace_json(path, content):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(content, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+class Checkpoint:
+    """Progress of one precompute run in `directory`.
+
+    Args:
+        directory (str): store directory the run writes into
+        inputs (dict): everything the outputs depend on; a checkpoint written for other inputs is never resumed
+        restart (bool): ignore any checkpoint and start over
+    Raises:
+        ValueError: if a checkpoint for different inputs is found and restart is False
+    """
+
+    def __init__(self, directory, inputs, restart=False):
+        self.directory = directory
+        self.path = os.path.join(directory, CHECKPOINT_NAME)
+        self.inputs = json.loads(json.dumps(inputs))
+        self.state = {'inputs': self.inputs, 'progress': {}, 'values': {}}
+        self.resumed = False
+        if os.path.exists(self.path) and not restart:
+            with open(self.path) as f:
+                state = json.load(f)
+            if state['inputs'] != self.inputs:
+                raise ValueError(f"{self.path} was written for different inputs; rerun with --restart to discard it")
+            self.state = state
+            self.resumed = True
+
+    def done_fields(self, stage):
+        """Number of fields of `stage` completed so far, in the order the stage visits them."""
+        return self.state['progress'].get(stage, 0)
+
+    def remaining(self, stage, ranges, chunk_steps):
+        """(start, stop) chunks of the field `ranges` that `stage` has still to do, in order."""
+        done = self.done_fields(stage)
+        chunks = []
+        for lo, hi in ranges:
+            start = lo + min(max(done, 0), hi - lo)
+            done -= hi - lo
+            chunks += [(s, min(s + chunk_steps, hi)) for s in range(start, hi, chunk_steps)]
+        return chunks
+
+    def advance(self, stage, n_fields, **values):
+        """Record n_fields more of `stage` as written, with any small JSON `values` to restore on resume."""
+        self.state['progress'][stage] = self.done_fields(stage) + n_fields
+        self.state['values'].update(values)
+        os.makedirs(self.directory, exist_ok=True)
+        _replace_json(self.path, self.state)
+
+    def value(self, name, default=None):
+        return self.state['values'].get(name, default)
+
+    def _arrays_path(self, name):
+        return os.path.join(self.directory, f'checkpoint-{name}.npz')
+
+    def save_arrays(self, name, **arrays):
+        """Keep in-memory arrays needed to resume, before the `advance` that relies on them."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._arrays_path(name)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+
+    def load_arrays(self, name):
+        with np.load(self._arrays_path(name)) as arrays:
+            return dict(arrays)
+
+    def has_arrays(self, name):
+        return self.resumed and os.path.exists(self._arrays_path(name))
+
+    def clear(self):
+        """Remove the checkpoint once the store is complete."""
+        for name in os.listdir(self.directory):
+            if name == CHECKPOINT_NAME or (name.startswith('checkpoint-') and name.endswith('.npz')):
+                os.remove(os.path.join(self.directory, name))
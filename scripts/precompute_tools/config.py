@@ -0,0 +1,104 @@
+import argparse
+
+import numpy as np
+
+from .refine import MAX_FIELDS as REFINE_MAX_FIELDS
+
+# Matches the grid precompute has always used: fine below 100 G, coarser above
+DEFAULT_B_GRID = '0.001:100:0.1,100:500:1,500:1001:10'
+
+
+def parse_b_grid(spec):
+    """Field grid in gauss from comma separated `start:stop:step` ranges.
+
+    Each range is expanded with `numpy.arange` and the pieces concatenated,
+    so the default spec gives exactly the hand-written grid in precompute.
+    """
+    pieces = []
+    for piece in spec.split(','):
+        start, stop, step = (float(x) for x in piece.split(':'))
+        pieces.append(np.arange(start, stop, step))
+    return np.concatenate(pieces)
+
+
+def _parse(parser, argv):
+    # parse_known_args so the same cell runs inside a notebook kernel, whose
+    # argv carries the kernel's own flags
+    return parser.parse_known_args(argv)[0]
+
+
+def precompute_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Diagonalise and precompute transition tables for one molecule.",
+                                     allow_abbrev=False)
+    parser.add_argument('--molecule', default="Rb87Cs133", help="name of the molecule in diatom.constants")
+    parser.add_argument('--n-max', type=int, default=3, help="highest rotational level in the basis")
+    parser.add_argument('--b-grid', default=DEFAULT_B_GRID, help="field grid in gauss as start:stop:step,...")
+    parser.add_argument('--refine-grid', action='store_true',
+                        help="halve the --b-grid steps where the moments or eigenvectors change quickly, see precompute_tools.refine")
+    parser.add_argument('--refine-moment-tol', type=float, default=10,
+                        help="largest change of any magnetic moment across one refined step, in Hz/G")
+    parser.add_argument('--refine-state-tol', type=float, default=1e-2,
+                        help="largest change of any eigenvector across one refined step")
+    parser.add_argument('--refine-min-step', type=float, default=1e-3, help="smallest refined step in gauss")
+    parser.add_argument('--refine-max-fields', type=int, default=REFINE_MAX_FIELDS,
+                        help="stop refining, with a warning, once the grid has this many fields")
+    parser.add_argument('--n-basis', type=int, default=None,
+                        help="diagonalise in a larger basis up to this N and keep only the N <= n_max states")
+    parser.add_argument('--diagonalisation', choices=['block', 'dense', 'continuation'], default='block',
+                        help="'continuation' follows the eigenvectors from field to field, keeping their order without smoothing but no faster than 'block' (needs --n-basis == --n-max)")
+    parser.add_argument('--paschen-back', type=float, default=None, metavar='HZ',
+                        help="use perturbation theory about the uncoupled basis wherever its estimated energy error is "
+                             "below this, diagonalising exactly elsewhere (needs --diagonalisation block)")
+    parser.add_argument('--paschen-back-state-tol', type=float, default=1e-6,
+                        help="largest estimated weight of the neglected state corrections for --paschen-back")
+    parser.add_argument('--subset-method', choices=['lapack', 'lanczos'], default='lapack',
+                        help="eigensolver for the lowest eigenpairs when --n-basis is larger than --n-max")
+    parser.add_argument('--storage-precision', choices=['double', 'single'], default='double',
+                        help="store states and couplings as float32/complex64, reporting the error this causes")
+    parser.add_argument('--states-layout', choices=['dense', 'block'], default='dense',
+                        help="store each eigenvector matrix dense or as its M_F blocks only")
+    parser.add_argument('--extend', action='store_true',
+                        help="keep the store already at --output and only compute the fields --b-grid adds to its ends")
+    parser.add_argument('--restart', action='store_true',
+                        help="discard the checkpoint of an interrupted run at --output instead of resuming it")
+    parser.add_argument('--serial', action='store_true', help="run the per-edge kernels and shortest paths on one core")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="cores this run may use in all, shared by BLAS, numba and worker processes (default: all)")
+    parser.add_argument('--eigh-split', type=int, nargs=2, metavar=('WORKERS', 'THREADS'), default=None,
+                        help="processes and BLAS threads each for the diagonalisation, see precompute_tools.scheduler")
+    parser.add_argument('--workers', type=int, default=None, help="processes for the shortest paths (default: --threads)")
+    parser.add_argument('--memory', type=float, default=4e9, help="working memory in bytes for each field chunk")
+    parser.add_argument('--output', default=None, help="store directory (default: ../precomputed/{molecule}NMax{n_max})")
+    return _parse(parser, argv)
+
+
+def grid_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute transition tables over B, E_dc and trap light for one molecule.",
+                                     allow_abbrev=False)
+    parser.add_argument('--molecule', default="Rb87Cs133", help="name of the molecule in diatom.constants")
+    parser.add_argument('--n-max', type=int, default=2, help="highest rotational level in the basis")
+    parser.add_argument('--b-grid', default='0.001:1000:10', help="field grid in gauss as start:stop:step,...")
+    parser.add_argument('--e-grid', default='0:5:0.25',
+                        help="DC electric field grid in kV/cm, same syntax as --b-grid")
+    parser.add_argument('--intensity-grid', default='0:1:1', help="trap light intensity grid in kW/cm^2")
+    parser.add_argument('--angle-grid', default='0:1:1',
+                        help="trap light polarisation angle to B grid in degrees; any angle but 0 mixes M_F")
+    parser.add_argument('--path-steps', type=int, default=32,
+                        help="continuation steps from zero out to each (E, intensity, angle) at the first B")
+    parser.add_argument('--tile', type=int, nargs=2, default=(16, 64), metavar=('ROWS', 'B'),
+                        help="tile size along the (E, intensity, angle) rows and B of the stored tables")
+    parser.add_argument('--threads', type=int, default=None,
+                        help="cores this run may use in all, split evenly between the workers (default: all)")
+    parser.add_argument('--workers', type=int, default=None, help="processes for the grid rows (default: --threads)")
+    parser.add_argument('--memory', type=float, default=1e9, help="working memory in bytes for each row's field chunk")
+    parser.add_argument('--output', default=None,
+                        help="store directory (default: ../precomputed/{molecule}NMax{n_max}Grid)")
+    return _parse(parser, argv)
+
+
+def optimiser_arguments(argv=None, molecule="Rb87Cs133", n_max=2):
+    parser = argparse.ArgumentParser(description="Optimise state structures from a precomputed store.",
+                                     allow_abbrev=False)
+    parser.add_argument('--molecule', default=molecule, help="name of the molecule in diatom.constants")
+    parser.add_argument('--n-max', type=int, default=n_max, help="N_MAX of the precomputed store to load")
+    return _parse(parser, argv)
@@ -0,0 +1,71 @@
+import numpy as np
+from numba import njit, prange
+from scipy.sparse import csr_matrix
+
+# Polarisation driving each of the six edge_jump_list sections
+# (up: zero, plus, minus, then down: zero, plus, minus)
+SECTION_POLARISATIONS = np.array([0, +1, -1, 0, +1, -1])
+
+
+def edge_polarisations(edge_jump_list):
+    """Polarisation (0, +1 or -1) of every edge, read off the edge_jump_list sections.
+
+    Edges are laid out state by state, and within a state section by section,
+    so the section lengths alone give the polarisation of each edge.
+    """
+    section_lengths = np.diff(edge_jump_list, axis=1).ravel()
+    sections = np.tile(np.arange(6), len(edge_jump_list))
+    return np.repeat(SECTION_POLARISATIONS[sections], section_lengths)
+
+
+@njit(parallel=True, cache=True)
+def _edge_dot(states_t, dipole_states_t, edge_from, edge_to, edge_ids, out):
+    n_b = states_t.shape[0]
+    for k in prange(len(edge_ids)):
+        e = edge_ids[k]
+        i = edge_from[e]
+        j = edge_to[e]
+        for b in range(n_b):
+            out[e, b] = np.vdot(states_t[b, i], dipole_states_t[b, j]).real
+
+
+def edge_couplings(states, dipole_ops, edge_indices, edge_polarisation, out=None):
+    """Transition dipole moments along each edge only.
+
+    For every edge (i, j) with polarisation p this is <i|d_p|j> at every field
+    in `states`. Each dipole operator is applied once per field as a sparse
+    product, and only the edge matrix elements are contracted from it, so the
+    B x S x S coupling stacks are never formed.
+
+    Args:
+        states (numpy.ndarray): eigenvectors [b,uncoupled,coupled] in canonical order
+        dipole_ops (dict): polarisation (0, +1, -1) -> dipole operator in the uncoupled basis
+        edge_indices (numpy.ndarray): E x 2 (from, to) canonical state indices
+        edge_polarisation (numpy.ndarray): polarisation of every edge, from `edge_polarisations`
+        out (numpy.ndarray): optional E x b array to write into
+    Returns:
+        couplings (numpy.ndarray): E x b real part of the edge transition dipole moments
+    """
+    n_b, n_states, _ = states.shape
+    result = np.zeros((len(edge_indices), n_b), dtype=np.double)
+
+    edge_from = np.ascontiguousarray(edge_indices[:, 0])
+    edge_to = np.ascontiguousarray(edge_indices[:, 1])
+    dtype = np.result_type(states, *dipole_ops.values())
+    # [b,coupled,uncoupled] so each eigenvector is contiguous
+    states_t = np.ascontiguousarray(states.transpose(0, 2, 1), dtype=dtype)
+    flat_states = states.transpose(1, 0, 2).reshape(n_states, n_b*n_states)
+    for p, dipole_op in dipole_ops.items():
+        edge_ids = np.flatnonzero(edge_polarisation == p)
+        if len(edge_ids) == 0:
+            continue
+        dipole_states = csr_matrix(dipole_op) @ flat_states
+        dipole_states_t = np.ascontiguousarray(
+            dipole_states.reshape(n_states, n_b, n_states).transpose(1, 2, 0), dtype=dtype)
+        _edge_dot(states_t, dipole_states_t, edge_from, edge_to, edge_ids, result)
+        del dipole_states, dipole_states_t
+
+    if out is None:
+        return result
+    out[...] = result
+    return out
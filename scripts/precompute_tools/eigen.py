@@ -0,0 +1,241 @@
+import numpy as np
+import scipy.linalg
+from numpy.linalg import eigh
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.linalg import eigsh
+
+
+def uncoupled_labels_d(n_max, I1_D, I2_D):
+    """(N, MN, MI1_D, MI2_D) of every uncoupled basis state, in the order diatom builds them."""
+    labels = []
+    for n in range(0, n_max + 1):
+        for mn in range(n,-(n+1),-1):
+            for mi1d in range(I1_D,-I1_D-1,-2):
+                for mi2d in range(I2_D,-I2_D-1,-2):
+                    labels.append((n,mn,mi1d,mi2d))
+    return np.array(labels, dtype=int)
+
+
+def mf_d_of_uncoupled(uncoupled_labels_d):
+    """Twice the total M_F of each uncoupled basis state.
+
+    Args:
+        uncoupled_labels_d (numpy.ndarray): rows of (N, MN, MI1_D, MI2_D)
+    Returns:
+        MF_D (numpy.ndarray): 2*MN + MI1_D + MI2_D for every basis state
+    """
+    uncoupled_labels_d = np.asarray(uncoupled_labels_d)
+    return 2*uncoupled_labels_d[:, 1] + uncoupled_labels_d[:, 2] + uncoupled_labels_d[:, 3]
+
+
+def real_if_symmetric(*matrices, atol=0.0):
+    """Real parts of Hermitian matrices that are in fact real symmetric, else the matrices unchanged.
+
+    A real symmetric H takes LAPACK's real dsyevd path with real eigenvectors,
+    half the memory and about a quarter of the arithmetic of the complex one.
+    The matrices are converted together, so any linear combination of them is
+    real exactly when each of them is.
+    """
+    if all(np.max(np.abs(np.imag(m)), initial=0.0) <= atol for m in matrices):
+        return tuple(np.ascontiguousarray(np.real(m)) for m in matrices)
+    return matrices
+
+
+def mf_blocks(uncoupled_labels_d):
+    """Group the uncoupled basis into blocks of equal total M_F.
+
+    Args:
+        uncoupled_labels_d (numpy.ndarray): rows of (N, MN, MI1_D, MI2_D)
+    Returns:
+        MF_D (numpy.ndarray): the M_F_D value of each block, ascending
+        blocks (list of numpy.ndarray): basis indices belonging to each block
+    """
+    mf_d = mf_d_of_uncoupled(uncoupled_labels_d)
+    mf_d_values = np.unique(mf_d)
+    return mf_d_values, [np.flatnonzero(mf_d == v) for v in mf_d_values]
+
+
+def off_block_max(matrix, blocks):
+    """Largest element of `matrix` coupling basis states from different blocks."""
+    block_of = np.empty(matrix.shape[-1], dtype=int)
+    for bi, idx in enumerate(blocks):
+        block_of[idx] = bi
+    off_block = block_of[:, None] != block_of[None, :]
+    return np.max(np.abs(matrix[..., off_block]), initial=0.0)
+
+
+def check_block_diagonal(matrix, blocks, atol=0.0):
+    """Raise if `matrix` couples basis states from different blocks."""
+    worst = off_block_max(matrix, blocks)
+    if worst > atol:
+        raise ValueError(f"matrix is not block diagonal in M_F (largest off-block element {worst:.3e})")
+
+
+def subset_eigh(h, k, method='lapack'):
+    """Lowest k eigenpairs of a single Hermitian matrix, in ascending energy.
+
+    'lapack' uses the MRRR subset driver, which only computes the requested
+    eigenvectors; 'lanczos' runs shift-invert Lanczos on the sparse matrix,
+    shifted to a Gershgorin lower bound of the spectrum so that the closest
+    eigenvalues are the lowest ones.
+    """
+    if k >= h.shape[0]:
+        return eigh(h)
+    if method == 'lapack':
+        return scipy.linalg.eigh(h, subset_by_index=[0, k-1], driver='evr')
+    if method == 'lanczos':
+        off_diagonal = np.sum(np.abs(h), axis=1) - np.abs(np.diagonal(h))
+        sigma = np.min(np.diagonal(h).real - off_diagonal)
+        sigma -= 1e-6*max(abs(sigma), 1.0)
+        energies, states = eigsh(csr_matrix(h), k=k, sigma=sigma, which='LM')
+        order = np.argsort(energies)
+        return energies[order], states[:, order]
+    raise ValueError(f"unknown subset method {method!r}")
+
+
+def lowest_eigh(H, k, method='lapack'):
+    """`subset_eigh` over a stack of matrices H[b], returning B x k energies and B x S x k states."""
+    energies = np.empty((H.shape[0], k), dtype=np.double)
+    states = np.empty((H.shape[0], H.shape[1], k), dtype=np.result_type(H, np.double))
+    for b in range(H.shape[0]):
+        energies[b], states[b] = subset_eigh(H[b], k, method)
+    return energies, states
+
+
+def block_eigh(H0, Hz, B, blocks, n_lowest=None, method='lapack'):
+    """Diagonalise H0 + Hz*B at every field one M_F block at a time.
+
+    The full Hamiltonian stack is never formed; each block is built and
+    diagonalised on its own and the eigenpairs scattered back into the
+    uncoupled basis. Columns are returned in ascending energy at each field,
+    exactly as `numpy.linalg.eigh` on the dense stack would give them, so
+    `calculate.sort_smooth` and `calculate.sort_by_state` work unchanged.
+
+    Args:
+        H0 (numpy.ndarray): field-free Hamiltonian, S x S
+        Hz (numpy.ndarray): Zeeman Hamiltonian per unit field, S x S
+        B (numpy.ndarray): fields to diagonalise at
+        blocks (list of numpy.ndarray): basis indices of each M_F block, from `mf_blocks`
+        n_lowest (list of int): if given, only keep this many of the lowest eigenpairs of each block
+        method (str): 'lapack' or 'lanczos' solver for the blocks that are truncated, see `subset_eigh`
+    Returns:
+        energies (numpy.ndarray): B x K eigenenergies, K = S unless n_lowest is given
+        states (numpy.ndarray): B x S x K eigenvectors, states[b,:,i] is the ith state
+    """
+    B = np.atleast_1d(B)
+    n_states = H0.shape[0]
+    if n_lowest is None:
+        n_lowest = [len(idx) for idx in blocks]
+    n_kept = sum(n_lowest)
+    energies = np.empty((len(B), n_kept), dtype=np.double)
+    states = np.zeros((len(B), n_states, n_kept), dtype=np.result_type(H0, Hz, np.double))
+
+    col = 0
+    for idx, k in zip(blocks, n_lowest):
+        if k == 0:
+            continue
+        sub = np.ix_(idx, idx)
+        h = H0[sub] + Hz[sub]*B[:, None, None]
+        if k < len(idx):
+            block_energies, block_states = lowest_eigh(h, k, method)
+        else:
+            block_energies, block_states = eigh(h)
+        energies[:, col:col+k] = block_energies
+        states[:, idx, col:col+k] = block_states
+        col += k
+
+    order = np.argsort(energies, axis=1, kind='stable')
+    energies = np.take_along_axis(energies, order, axis=1)
+    states = np.take_along_axis(states, order[:, None, :], axis=2)
+    return energies, states
+
+
+def _orthonormalise(v, steps=2):
+    # Newton-Schulz iteration towards the nearest orthonormal columns, cheap
+    # and unbiased when v is already close to orthonormal
+    identity = np.eye(v.shape[1])
+    for _ in range(steps):
+        v = v @ (1.5*identity - 0.5*(v.conj().T @ v))
+    return v
+
+
+def _refine(h, v, tol, gap_ratio, max_iterations):
+    # h in the basis of the previous eigenvectors, rotated by first-order
+    # corrections; returns None when two states are too close to follow
+    scale = max(np.max(np.abs(np.diagonal(h))), np.finfo(np.double).tiny)
+    for _ in range(max_iterations):
+        a = v.conj().T @ h @ v
+        d = np.diagonal(a).real
+        off = a - np.diag(np.diagonal(a))
+        worst = np.max(np.abs(off), initial=0.0)
+        if worst <= tol*scale:
+            return d, v
+        gaps = d[None, :] - d[:, None]
+        np.fill_diagonal(gaps, np.inf)
+        if np.any(np.abs(off) > gap_ratio*np.abs(gaps)):
+            return None
+        v = _orthonormalise(v + v @ (off/gaps))
+    return None
+
+
+def match_columns(states_prev, states):
+    """Permutation of the columns of `states` that best overlaps `states_prev` column by column."""
+    overlaps = np.abs(states_prev.conj().T @ states)
+    _, columns = linear_sum_assignment(-overlaps)
+    return columns
+
+
+def continuation_eigh(H0, Hz, B, blocks, states_start, tol=1e-13, gap_ratio=0.1, max_iterations=4):
+    """Follow a set of eigenvectors along the field axis.
+
+    At each field the previous eigenvectors of every M_F block are refined
+    with first-order perturbative corrections until the Hamiltonian is
+    diagonal in them to `tol`. They span the whole block, so this is not a
+    reduced subspace and each step costs about as much as an `eigh` of the
+    block; what it buys is the ordering. Column i always continues column i,
+    so labels carry over with no overlap search or smoothing. Where two states
+    of one M_F block come too close for perturbation theory to be trusted,
+    that block is diagonalised in full and its columns matched to the
+    previous field by maximum overlap.
+
+    Args:
+        H0 (numpy.ndarray): field-free Hamiltonian, S x S
+        Hz (numpy.ndarray): Zeeman Hamiltonian per unit field, S x S
+        B (numpy.ndarray): fields to step through, in order
+        blocks (list of numpy.ndarray): basis indices of each M_F block, from `mf_blocks`
+        states_start (numpy.ndarray): S x S eigenvectors at the field just before B[0]
+        tol (float): off-diagonal tolerance relative to the largest diagonal element
+        gap_ratio (float): largest coupling/gap ratio handled perturbatively
+    Returns:
+        energies (numpy.ndarray): B x S eigenenergies, in the column order of states_start
+        states (numpy.ndarray): B x S x S eigenvectors
+        n_fallbacks (int): number of (field, block) pairs that needed a full diagonalisation
+    """
+    B = np.atleast_1d(B)
+    n_states = H0.shape[0]
+    block_of_row = np.empty(n_states, dtype=int)
+    for bi, idx in enumerate(blocks):
+        block_of_row[idx] = bi
+    block_of_column = block_of_row[np.argmax(np.abs(states_start), axis=0)]
+    columns = [np.flatnonzero(block_of_column == bi) for bi in range(len(blocks))]
+
+    energies = np.empty((len(B), n_states), dtype=np.double)
+    states = np.zeros((len(B), n_states, n_states), dtype=np.result_type(H0, Hz, states_start, np.double))
+    n_fallbacks = 0
+    previous = states_start
+    for b, field in enumerate(B):
+        for idx, cols in zip(blocks, columns):
+            sub = np.ix_(idx, idx)
+            h = H0[sub] + Hz[sub]*field
+            v_prev = previous[np.ix_(idx, cols)]
+            refined = _refine(h, v_prev, tol, gap_ratio, max_iterations)
+            if refined is None:
+                n_fallbacks += 1
+                block_energies, block_states = eigh(h)
+                order = match_columns(v_prev, block_states)
+                refined = block_energies[order], block_states[:, order]
+            energies[b, cols] = refined[0]
+            states[b, idx[:, None], cols[None, :]] = refined[1]
+        previous = states[b]
+    return energies, states, n_fallbacks
@@ -0,0 +1,145 @@
+"""Precompute the transition tables over B and any further field axes.
+
+Every extra axis (DC field, trap light intensity and polarisation, ...)
+enters the Hamiltonian linearly, so a point off the B axis is one row,
+H0 + sum_k c_k H_k + Hz*B, with the terms H_k built once and only the row's
+coefficients c_k changing. States are labelled once at (c=0, B[0]); each
+row follows them along a straight path out to its own c at B[0], then along
+B by continuation. Rows are independent and run in parallel processes,
+chunk by chunk along B, and every table is written into a `TiledArray` so
+that lines along either the row or the B axis are cheap to read back.
+"""
+import os
+
+import numpy as np
+
+from .couplings import edge_couplings
+from .eigen import block_eigh, continuation_eigh
+from .labels import block_labels_d, canonical_order
+from .paths import ShortestPaths
+from .scheduler import available_cores, fork_pool, limit_threads
+from .store import TiledArray, chunk_bounds
+from .transitions import transition_tables
+
+# name -> (leading axis, dtype) of every table on the grid; 'states' or 'edges'
+GRID_TABLES = {
+    'energies': ('states', np.double),
+    'magnetic_moments': ('states', np.double),
+    'couplings_sparse': ('edges', np.double),
+    'transition_gate_times_unpol': ('edges', np.double),
+    'transition_gate_times_pol': ('edges', np.double),
+    'pair_resonance': ('edges', np.double),
+    'cumulative_unpol_time_from_initials': ('states', np.double),
+    'predecessor_unpol_time_from_initials': ('states', int),
+    'cumulative_pol_time_from_initials': ('states', np.double),
+    'predecessor_pol_time_from_initials': ('states', int),
+}
+
+_CONTEXT = {}
+
+
+def create_grid_tables(directory, n_states, n_edges, n_rows, n_b, tile):
+    """Preallocate every grid table in `directory` as a TiledArray, keyed by name."""
+    lengths = {'states': n_states, 'edges': n_edges}
+    return {name: TiledArray.create(directory, name, (lengths[axis], n_rows, n_b), tile, dtype)
+            for name, (axis, dtype) in GRID_TABLES.items()}
+
+
+def label_start(H0, Hz, b0, blocks, uncoupled_labels_d, canonical_labels_d):
+    """Canonically ordered S x S eigenvectors of H0 + Hz*b0, labelled as in the field sweep."""
+    energies, states = block_eigh(H0, Hz, [b0], blocks)
+    labels_d = block_labels_d(energies[0], states[0], uncoupled_labels_d, blocks)
+    return states[0][:, canonical_order(labels_d, canonical_labels_d)]
+
+
+def _set_context(context, threads):
+    limit_threads(threads)
+    _CONTEXT.clear()
+    _CONTEXT.update(context)
+    # Each process reopens the tables for writing; rows never overlap
+    _CONTEXT['tables'] = {name: TiledArray(np.load(os.path.join(context['directory'], f'{name}.npy'), mmap_mode='r+'),
+                                           shape) for name, shape in context['table_shapes'].items()}
+
+
+def _row(row):
+    c = _CONTEXT
+    index = c['index']
+    coefficients = c['coefficients'][row]
+    offset = sum(coefficient*term for coefficient, term in zip(coefficients, c['terms']) if coefficient != 0)
+    # Rows with any M_F-mixing term have to be followed as one block
+    conserves_mf = all(ok for coefficient, ok in zip(coefficients, c['terms_conserve_mf']) if coefficient != 0)
+    blocks = c['blocks'] if conserves_mf else [np.arange(len(index.labels_d))]
+
+    previous = c['states_start']
+    n_fallbacks = 0
+    if np.any(coefficients != 0):
+        path = np.linspace(0, 1, c['path_steps']+1)[1:]
+        _, states, n_fallbacks = continuation_eigh(c['H0'] + c['Hz']*c['b'][0], offset, path, blocks, previous)
+        previous = states[-1]
+
+    h0 = c['H0'] + offset
+    paths = ShortestPaths(index.edge_indices, len(index.labels_d))
+    for b_start, b_stop in chunk_bounds(len(c['b']), c['chunk_steps']):
+        energies, states, fallbacks = continuation_eigh(h0, c['Hz'], c['b'][b_start:b_stop], blocks, previous)
+        previous = states[-1]
+        n_fallbacks += fallbacks
+
+        couplings = edge_couplings(states, c['dipole_ops'], index.edge_indices, c['edge_polarisation'])
+        t_g_unpol, t_g_pol, omegas = transition_tables(energies.T, couplings, index.labels_d, index.edge_indices,
+                                                       index.edge_jump_list, parallel=False)
+        cumulative_unpol, predecessor_unpol = paths.from_sources(t_g_unpol, c['initial_state_indices'], workers=1)
+        cumulative_pol, predecessor_pol = paths.from_sources(t_g_pol, c['initial_state_indices'], workers=1)
+        results = {
+            'energies': energies.T,
+            'magnetic_moments': np.einsum('bji,jk,bki->ib', states.conj(), -c['Hz'], states, optimize='optimal').real,
+            'couplings_sparse': couplings,
+            'transition_gate_times_unpol': t_g_unpol,
+            'transition_gate_times_pol': t_g_pol,
+            'pair_resonance': omegas,
+            'cumulative_unpol_time_from_initials': cumulative_unpol,
+            'predecessor_unpol_time_from_initials': predecessor_unpol,
+            'cumulative_pol_time_from_initials': cumulative_pol,
+            'predecessor_pol_time_from_initials': predecessor_pol,
+        }
+        for name, values in results.items():
+            c['tables'][name].write(row, b_start, values)
+    for table in c['tables'].values():
+        table.flush()
+    return row, n_fallbacks
+
+
+def run_grid(context, workers=None, threads=None):
+    """Fill the grid tables, one row per task.
+
+    Args:
+        context (dict): everything a row needs;
+            H0, Hz (numpy.ndarray): field-free and Zeeman per unit B Hamiltonians, S x S
+            terms (list of numpy.ndarray): the K Hamiltonians the row axes multiply
+            coefficients (numpy.ndarray): R x K coefficient of each term in each row
+            terms_conserve_mf (list of bool): whether each term is block diagonal in M_F
+            b (numpy.ndarray): magnetic fields, in order
+            blocks (list of numpy.ndarray): basis indices of each M_F block, from `eigen.mf_blocks`
+            states_start (numpy.ndarray): S x S canonical eigenvectors at (c=0, b[0]), from `label_start`
+            path_steps (int): continuation steps from c=0 out to each row's coefficients
+            dipole_ops, edge_polarisation, index, initial_state_indices: as in precompute
+            chunk_steps (int): fields per chunk along B
+            directory (str), table_shapes (dict): where the tables are, and each one's logical shape
+        workers (int): processes to spread the rows over, one per core if None, in-process if 1
+        threads (int): cores to use in all, shared evenly between the workers' BLAS; all available if None
+    Returns:
+        n_fallbacks (numpy.ndarray): full diagonalisations needed by the continuation in each row
+    """
+    n_rows = len(context['coefficients'])
+    n_fallbacks = np.zeros(n_rows, dtype=int)
+    threads = threads or available_cores()
+    workers = workers or threads
+    if workers == 1:
+        _set_context(context, threads)
+        for row in range(n_rows):
+            n_fallbacks[row] = _row(row)[1]
+        return n_fallbacks
+
+    with fork_pool(workers, _set_context, (context, max(1, threads // workers))) as pool:
+        for row, fallbacks in pool.map(_row, range(n_rows)):
+            n_fallbacks[row] = fallbacks
+    return n_fallbacks
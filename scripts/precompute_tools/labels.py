@@ -0,0 +1,85 @@
+import numpy as np
+
+from .eigen import match_columns, mf_d_of_uncoupled
+
+
+def block_labels_d(energies, states, uncoupled_labels_d, blocks):
+    """Label the eigenstates at one low field as (N, MF_D, d) without any overlap search.
+
+    M_F is conserved, so each eigenvector lives in one M_F block and MF_D is
+    read off that block. Within a block, at fields where the rotational
+    splitting dominates, the states are ordered by N: the lowest
+    degeneracy(0, MF_D) are N=0, the next degeneracy(1, MF_D) are N=1 and so
+    on, and d counts up in energy within each (N, MF_D). This matches the
+    labels `calculate.sort_by_state` gives at the start of the field grid.
+
+    Args:
+        energies (numpy.ndarray): K eigenenergies at the field
+        states (numpy.ndarray): S x K eigenvectors in the uncoupled basis
+        uncoupled_labels_d (numpy.ndarray): rows of (N, MN, MI1_D, MI2_D) for the S basis states
+        blocks (list of numpy.ndarray): basis indices of each M_F block, from `eigen.mf_blocks`
+    Returns:
+        labels_d (numpy.ndarray): K x 3 labels (N, MF_D, d), one row per column of states
+    Raises:
+        ValueError: if the ordering disagrees with <N(N+1)>, i.e. the field is too high
+    """
+    uncoupled_labels_d = np.asarray(uncoupled_labels_d)
+    block_of_row = np.empty(len(uncoupled_labels_d), dtype=int)
+    for bi, idx in enumerate(blocks):
+        block_of_row[idx] = bi
+    block_of_column = block_of_row[np.argmax(np.abs(states), axis=0)]
+
+    labels_d = np.empty((states.shape[1], 3), dtype=int)
+    for bi, idx in enumerate(blocks):
+        cols = np.flatnonzero(block_of_column == bi)
+        cols = cols[np.argsort(energies[cols], kind='stable')]
+        n_by_rank = np.sort(uncoupled_labels_d[idx, 0])[:len(cols)]
+        first_of_n = np.searchsorted(n_by_rank, n_by_rank, side='left')
+        labels_d[cols, 0] = n_by_rank
+        labels_d[cols, 1] = mf_d_of_uncoupled(uncoupled_labels_d[idx[:1]])[0]
+        labels_d[cols, 2] = np.arange(len(cols)) - first_of_n
+
+    n = uncoupled_labels_d[:, 0]
+    n_squared = (n*(n+1)) @ (np.abs(states)**2)
+    n_expected = np.rint((np.sqrt(1 + 4*n_squared) - 1)/2).astype(int)
+    wrong = np.flatnonzero(n_expected != labels_d[:, 0])
+    if len(wrong):
+        raise ValueError(f"{len(wrong)} states are not ordered by N within their M_F block; label at a lower field")
+    return labels_d
+
+
+def canonical_order(labels_d, canonical_labels_d):
+    """Column of `labels_d` holding each label of `canonical_labels_d`, found with one hash join."""
+    column_of = {label: c for c, label in enumerate(map(tuple, np.asarray(labels_d).tolist()))}
+    return np.array([column_of[label] for label in map(tuple, np.asarray(canonical_labels_d).tolist())])
+
+
+def reconcile_columns(energies, states, stored_energies, stored_states, rtol=1e-9):
+    """Order and phase freshly diagonalised eigenpairs like ones stored in canonical order at the same field.
+
+    Columns are matched by maximum overlap and each is rotated onto the phase
+    of its stored state, so couplings carry on continuously. The matched
+    energies must agree with the stored ones, so a store written for another
+    molecule, basis or field fails here rather than being silently extended.
+
+    Args:
+        energies (numpy.ndarray): S eigenenergies
+        states (numpy.ndarray): S x S eigenvectors [uncoupled,coupled]
+        stored_energies (numpy.ndarray): S stored energies in canonical order
+        stored_states (numpy.ndarray): S x S stored eigenvectors in canonical order, at any precision
+        rtol (float): largest energy mismatch relative to the largest energy
+    Returns:
+        energies (numpy.ndarray): S eigenenergies in canonical order
+        states (numpy.ndarray): S x S eigenvectors in canonical order
+    Raises:
+        ValueError: if the matched energies disagree
+    """
+    stored_states = np.asarray(stored_states, dtype=states.dtype)
+    order = match_columns(stored_states, states)
+    energies, states = energies[order], states[:, order]
+    mismatch = np.max(np.abs(energies - stored_energies)) / np.max(np.abs(stored_energies))
+    if mismatch > rtol:
+        raise ValueError(f"stored energies differ from the recomputed ones by {mismatch:.3e} (relative); "
+                         "the store was built with different inputs")
+    overlaps = np.einsum('ij,ij->j', stored_states.conj(), states)
+    return energies, states * (overlaps.conj() / np.abs(overlaps))
@@ -0,0 +1,26 @@
+"""AC Stark (trap light) Hamiltonian at any intensity and polarisation angle.
+
+The light shift is linear in intensity, and every component of the rank-2
+polarisability tensor picks up a Wigner d^2_{P0}(beta) factor, which is a
+homogeneous quadratic in (cos beta, sin beta); the scalar part is too, as
+cos^2 + sin^2. So
+
+    Hac(beta) = cos^2(beta) Hac(0) + sin^2(beta) Hac(90) + sin(beta)cos(beta) K,
+    K = 2 Hac(45) - Hac(0) - Hac(90),
+
+and three builds of the Hamiltonian cover every angle. Only beta = 0, light
+polarised along B, conserves M_F.
+"""
+import numpy as np
+
+
+def polarisation_terms(hac_0, hac_45, hac_90):
+    """Terms (cos^2, sin^2, sin cos) of Hac(beta), from Hac per unit intensity at 0, 45 and 90 degrees."""
+    return hac_0, hac_90, 2*hac_45 - hac_0 - hac_90
+
+
+def polarisation_coefficients(intensity, beta):
+    """Coefficients of the `polarisation_terms` at each (intensity, beta), broadcast, with a trailing axis of 3."""
+    intensity, beta = np.broadcast_arrays(intensity, beta)
+    c, s = np.cos(beta), np.sin(beta)
+    return intensity[..., None] * np.stack([c*c, s*s, s*c], axis=-1)
@@ -0,0 +1,53 @@
+"""Field derivatives of the magnetic moments, and the field tolerance they give.
+
+With H = H0 + B*Hz and V = states^dagger Hz states at one field, the moments
+mu_i = -dE_i/dB = -V_ii, and the higher derivatives follow from the usual
+perturbation sums over the other eigenpairs at the same field:
+
+    dmu_i/dB     = -2 sum_j |V_ij|^2 / (E_i - E_j)
+    d2mu_i/dB2   = -6 [ sum_jk V_ij V_jk V_ki / ((E_i - E_j)(E_i - E_k)) - V_ii sum_j |V_ij|^2 / (E_i - E_j)^2 ]
+
+with j, k != i. No neighbouring fields are needed, so these are exact on any
+grid, including at moment crossings where finite differences of the moments
+are at their worst.
+"""
+import numpy as np
+from numba import njit
+
+# B x S x S complex arrays `moment_derivatives` holds at its peak: V (and Hz @ states before it), the gaps,
+# W, and the W V product inside the third-order einsum
+WORKING_COPIES = 4
+
+
+def moment_derivatives(energies, states, Hz, coupling_tol=1e-10):
+    """dmu/dB and d2mu/dB2 of every state at every field.
+
+    Args:
+        energies (numpy.ndarray): B x K eigenenergies
+        states (numpy.ndarray): B x S x K eigenvectors
+        Hz (numpy.ndarray): Zeeman Hamiltonian per unit field, S x S
+        coupling_tol (float): |V_ij| below this fraction of the largest are rounding error, e.g. between
+            M_F blocks, and left out even where the states are (nearly) degenerate
+    Returns:
+        dmu_db (numpy.ndarray): K x B first derivatives of the magnetic moments
+        d2mu_db2 (numpy.ndarray): K x B second derivatives
+    """
+    V = states.conj().transpose(0, 2, 1) @ (Hz @ states)
+    gaps = energies[:, :, None] - energies[:, None, :]
+    coupled = np.abs(V) > coupling_tol*np.abs(V).max()
+    W = np.divide(V, gaps, out=np.zeros_like(V), where=coupled & (gaps != 0))
+
+    second = np.einsum('bij,bij->bi', V.conj(), W).real
+    third = (np.einsum('bij,bjk,bik->bi', W, V, W.conj(), optimize='optimal')
+             - np.einsum('bii->bi', V)*np.einsum('bij,bij->bi', W.conj(), W)).real
+    return -2*second.T, -6*third.T
+
+
+@njit(cache=True)
+def field_tolerance(moment_spread, slope_spread, energy_tolerance):
+    """Largest field error delta with moment_spread*delta + slope_spread*delta^2/2 <= energy_tolerance.
+
+    Away from moment crossings this is energy_tolerance/moment_spread, as from the moments alone; at a
+    crossing the slope term keeps it finite.
+    """
+    return 2*energy_tolerance/(moment_spread + np.sqrt(moment_spread**2 + 2*slope_spread*energy_tolerance))
@@ -0,0 +1,98 @@
+"""Disk and in-memory cache of the Hamiltonian components and dipole operators.
+
+`diatom.hamiltonian.build_hamiltonians` and `diatom.calculate.dipole` redo the
+angular momentum algebra from scratch on every call, which dominates start up
+for the larger N_MAX. Here each term is built once per (molecule constants,
+N_MAX, term), saved to ../precomputed/operators/<key>.npy and loaded back
+memory-mapped, read only. The key also hashes the diatom source, so a change
+to it never serves a stale matrix.
+
+The functions take the same arguments and return the same values as the
+diatom ones they stand in for.
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+
+import numpy as np
+
+from .batch import SCRIPTS_DIR
+
+OPERATOR_DIR = os.path.join(SCRIPTS_DIR, '..', 'precomputed', 'operators')
+HAMILTONIAN_TERMS = ('H0', 'Hz', 'Hdc', 'Hac')
+
+_MEMORY = {}
+
+
+@functools.lru_cache(maxsize=None)
+def diatom_version():
+    """Hash of the diatom source the operators are built by."""
+    import diatom.calculate
+    import diatom.hamiltonian
+
+    digest = hashlib.sha256()
+    for module in (diatom.hamiltonian, diatom.calculate):
+        with open(inspect.getsourcefile(module), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def operator_key(term, **inputs):
+    """Key of one operator matrix, from its name and everything it is built from."""
+    inputs = json.dumps({'term': term, 'diatom': diatom_version(), **inputs}, sort_keys=True, default=str)
+    return f'{term}-{hashlib.sha256(inputs.encode()).hexdigest()[:24]}'
+
+
+def _load(key, operator_dir):
+    if key not in _MEMORY:
+        path = os.path.join(operator_dir, f'{key}.npy')
+        if not os.path.exists(path):
+            return None
+        _MEMORY[key] = np.load(path, mmap_mode='r')
+    return _MEMORY[key]
+
+
+def _save(key, matrix, operator_dir):
+    os.makedirs(operator_dir, exist_ok=True)
+    path = os.path.join(operator_dir, f'{key}.npy')
+    # Unique name per process, so concurrent builds of the same term cannot collide
+    partial = f'{path}.partial-{os.getpid()}.npy'
+    np.save(partial, np.asarray(matrix))
+    os.replace(partial, path)
+    return _load(key, operator_dir)
+
+
+def build_hamiltonians(n_max, constants, zeeman=False, Edc=False, ac=False, operator_dir=OPERATOR_DIR):
+    """`diatom.hamiltonian.build_hamiltonians`, building only the terms not cached yet.
+
+    Returns:
+        H0, Hz, Hdc, Hac (numpy.ndarray): read only; the terms not asked for are 0., as from diatom
+    """
+    import diatom.hamiltonian as hamiltonian
+
+    constants_json = json.loads(json.dumps(constants, sort_keys=True, default=str))
+    wanted = [term for term, on in zip(HAMILTONIAN_TERMS, (True, zeeman, Edc, ac)) if on]
+    keys = {term: operator_key(term, n_max=n_max, constants=constants_json) for term in wanted}
+    terms = {term: _load(key, operator_dir) for term, key in keys.items()}
+
+    missing = [term for term, matrix in terms.items() if matrix is None]
+    if missing:
+        built = hamiltonian.build_hamiltonians(n_max, constants, zeeman='Hz' in missing, Edc='Hdc' in missing,
+                                               ac='Hac' in missing)
+        for term, matrix in zip(HAMILTONIAN_TERMS, built):
+            if term in missing:
+                terms[term] = _save(keys[term], matrix, operator_dir)
+    return tuple(terms.get(term, 0.) for term in HAMILTONIAN_TERMS)
+
+
+def dipole(n_max, I1, I2, d, M, operator_dir=OPERATOR_DIR):
+    """`diatom.calculate.dipole`, built once per (N_MAX, I1, I2, d, M); read only."""
+    import diatom.calculate as calculate
+
+    key = operator_key('dipole', n_max=n_max, I1=I1, I2=I2, d=d, M=M)
+    matrix = _load(key, operator_dir)
+    if matrix is None:
+        matrix = _save(key, calculate.dipole(n_max, I1, I2, d, M), operator_dir)
+    return matrix
@@ -0,0 +1,74 @@
+"""Eigenpairs at high field from perturbation theory about the uncoupled basis.
+
+In the Paschen-Back regime the Zeeman term dominates the hyperfine coupling
+and each eigenstate is close to a single uncoupled basis state. With D the
+diagonal of H = H0 + B*Hz in the uncoupled basis, V the rest and
+W_ij = V_ij / (D_i - D_j), the energies to second order and the states to
+first order are
+
+    E_i = D_i + sum_j |V_ij|^2 / (D_i - D_j),    |i> = e_i + sum_j conj(W_ij) e_j
+
+with the sums running within each M_F block. The error is estimated by the
+next terms along: the weight sum_j |W_ij|^2 moved by the first-order
+correction, which is the size of the second-order one, and the third-order
+energy sum_jk W_ij V_jk conj(W_ik), bounded by that weight times the largest
+row sum of |V| so the test stays O(n^2) per field. Any (field, block) where
+either is over tolerance is diagonalised exactly instead, so a scan out to
+thousands of gauss only pays for `eigh` where the hyperfine structure still
+matters. The accepted first-order states are made orthonormal by a QR, which
+only moves them at second order.
+"""
+import numpy as np
+from numpy.linalg import eigh
+
+
+def paschen_back_eigh(H0, Hz, B, blocks, energy_tol, state_tol=1e-6):
+    """`eigen.block_eigh`, but perturbative wherever the error estimate allows.
+
+    Args:
+        H0, Hz (numpy.ndarray): field-free and Zeeman per unit field Hamiltonians in the uncoupled basis, S x S
+        B (numpy.ndarray): fields to diagonalise at
+        blocks (list of numpy.ndarray): basis indices of each M_F block, from `eigen.mf_blocks`
+        energy_tol (float): largest estimated energy error, in the units of H0
+        state_tol (float): largest estimated weight in the neglected second-order state corrections
+    Returns:
+        energies (numpy.ndarray): B x S eigenenergies, ascending at each field as from `block_eigh`
+        states (numpy.ndarray): B x S x S eigenvectors
+        exact (numpy.ndarray): B x len(blocks), True where a block had to be diagonalised exactly
+    """
+    B = np.atleast_1d(B)
+    n_states = H0.shape[0]
+    energies = np.empty((len(B), n_states), dtype=np.double)
+    states = np.zeros((len(B), n_states, n_states), dtype=np.result_type(H0, Hz, np.double))
+    exact = np.ones((len(B), len(blocks)), dtype=bool)
+
+    for bi, idx in enumerate(blocks):
+        sub = np.ix_(idx, idx)
+        h = H0[sub] + Hz[sub]*B[:, None, None]
+        d = np.diagonal(h, axis1=1, axis2=2).real
+        v = h - d[:, :, None]*np.eye(len(idx))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            w = np.divide(v, d[:, :, None] - d[:, None, :], out=np.zeros_like(v), where=v != 0)
+
+        weight = np.einsum('bij,bij->bi', w.conj(), w).real
+        v_norm = np.abs(v).sum(axis=2).max(axis=1)
+        ok = np.all(weight <= state_tol, axis=1) & np.all(weight*v_norm[:, None] <= energy_tol, axis=1)
+
+        block_energies = np.empty(d.shape)
+        block_states = np.empty(h.shape, dtype=states.dtype)
+        block_energies[ok] = d[ok] + np.einsum('bij,bij->bi', v[ok].conj(), w[ok]).real
+        q, r = np.linalg.qr(np.eye(len(idx)) + w[ok].conj().transpose(0, 2, 1))
+        # Phases as in the first-order states, so each column stays close to its uncoupled basis state
+        r_diagonal = np.diagonal(r, axis1=1, axis2=2)
+        block_states[ok] = q * (r_diagonal/np.abs(r_diagonal))[:, None, :]
+        if not np.all(ok):
+            block_energies[~ok], block_states[~ok] = eigh(h[~ok])
+
+        energies[:, idx] = block_energies
+        states[:, idx[:, None], idx[None, :]] = block_states
+        exact[:, bi] = ~ok
+
+    order = np.argsort(energies, axis=1, kind='stable')
+    energies = np.take_along_axis(energies, order, axis=1)
+    states = np.take_along_axis(states, order[:, None, :], axis=2)
+    return energies, states, exact
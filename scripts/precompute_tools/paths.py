@@ -0,0 +1,79 @@
+import numpy as np
+from scipy.sparse import csr_matrix, csgraph
+
+from .scheduler import available_cores, fork_pool
+from .store import chunk_bounds
+
+
+class ShortestPaths:
+    """Shortest paths through the transition graph at many fields.
+
+    The graph's sparsity pattern is fixed by the edge list; only the edge
+    weights change from field to field. The CSR structure is built once and
+    each field just drops its weight column into it before running Dijkstra.
+    """
+
+    def __init__(self, edge_indices, n_states):
+        self.n_states = n_states
+        # Build with 1-based edge numbers as data to learn where scipy puts each edge
+        order = csr_matrix((np.arange(1, len(edge_indices)+1), (edge_indices[:, 0], edge_indices[:, 1])),
+                           shape=(n_states, n_states))
+        self.indptr = order.indptr
+        self.indices = order.indices
+        self.edge_order = order.data - 1
+
+    def graph(self, weights):
+        """CSR graph with one field's edge weights (length E) in place."""
+        return csr_matrix((weights[self.edge_order], self.indices, self.indptr), shape=(self.n_states, self.n_states))
+
+    def _from_sources_block(self, weights, sources):
+        n_b = weights.shape[1]
+        cumulative = np.empty((self.n_states, n_b), dtype=np.double)
+        predecessor = np.empty((self.n_states, n_b), dtype=int)
+        for b in range(n_b):
+            distances, predecessors = csgraph.shortest_path(self.graph(weights[:, b]), method='D', directed=False,
+                                                            return_predecessors=True, indices=sources)
+            best_start = np.argmin(distances, axis=0)[None, :]
+            cumulative[:, b] = np.take_along_axis(distances, best_start, axis=0)[0]
+            predecessor[:, b] = np.take_along_axis(predecessors, best_start, axis=0)[0]
+        return cumulative, predecessor
+
+    def from_sources(self, weights, sources, workers=None, fields_per_task=32, pool=None):
+        """Cheapest path to every state from the best of `sources`, at every field.
+
+        Args:
+            weights (numpy.ndarray): E x B edge weights, e.g. transition_gate_times_unpol
+            sources (list): starting state indices
+            workers (int): processes to spread the fields over, all available cores if None, in-process if 1
+            fields_per_task (int): fields handed to a worker at a time
+            pool (concurrent.futures.Executor): workers to use instead of forking `workers` new ones, see
+                `scheduler.fork_pool`; needed once numba's parallel kernels have run in this process
+        Returns:
+            cumulative (numpy.ndarray): S x B total weight of the best path to each state
+            predecessor (numpy.ndarray): S x B previous state along that path (-9999 at a source)
+        """
+        n_b = weights.shape[1]
+        sources = np.asarray(sources)
+        cumulative = np.empty((self.n_states, n_b), dtype=np.double)
+        predecessor = np.empty((self.n_states, n_b), dtype=int)
+
+        workers = workers or available_cores()
+        bounds = chunk_bounds(n_b, fields_per_task)
+        if (pool is None and workers == 1) or len(bounds) == 1:
+            results = (self._from_sources_block(np.asarray(weights[:, start:stop]), sources) for start, stop in bounds)
+            for (start, stop), (c, p) in zip(bounds, results):
+                cumulative[:, start:stop], predecessor[:, start:stop] = c, p
+            return cumulative, predecessor
+
+        own_pool = pool is None
+        if own_pool:
+            pool = fork_pool(workers)
+        try:
+            futures = [pool.submit(self._from_sources_block, np.asarray(weights[:, start:stop]), sources)
+                       for start, stop in bounds]
+            for (start, stop), future in zip(bounds, futures):
+                cumulative[:, start:stop], predecessor[:, start:stop] = future.result()
+        finally:
+            if own_pool:
+                pool.shutdown()
+        return cumulative, predecessor
@@ -0,0 +1,472 @@
+"""Diagonalise one molecule over a field grid and precompute its transition tables.
+
+`precompute` is the computation behind the precompute notebook, which only
+parses the command line, calls it and plots the store it writes. Keeping it
+here means the cache key (`cache.code_version`) covers this module and the
+tools it imports, and not the notebook's plots and prose. It also runs on its
+own, with the same arguments as the notebook:
+
+    python -m precompute_tools.pipeline --molecule K40Rb87 --n-max 2 --b-grid 0.001:1000:10
+"""
+import os
+import shutil
+from functools import partial
+
+import diatom.constants
+import numpy as np
+import scipy.constants
+from numpy.linalg import eigh
+from tqdm import tqdm
+
+from . import operators
+from .blocks import BlockLayout
+from .checkpoint import Checkpoint
+from .config import parse_b_grid, precompute_arguments
+from .couplings import edge_couplings, edge_polarisations
+from .eigen import (block_eigh, check_block_diagonal, continuation_eigh, lowest_eigh, mf_blocks, real_if_symmetric,
+                    uncoupled_labels_d)
+from .labels import block_labels_d, canonical_order, reconcile_columns
+from .moments import WORKING_COPIES as MOMENT_WORKING_COPIES, moment_derivatives
+from .paschen_back import paschen_back_eigh
+from .paths import ShortestPaths
+from .precision import PrecisionReport, storage_dtype
+from .refine import field_summaries, refine_grid
+from .scheduler import EighScheduler, available_cores, fork_pool, limit_threads
+from .state_index import node_index, state_index
+from .store import chunk_bounds, chunk_steps_for_memory, copy_fields, load_store, open_output, save_store
+from .tracking import track_states
+from .transitions import transition_tables
+
+
+def precompute(args):
+    """Write the store for `args` (from `config.precompute_arguments`) and return its directory."""
+    MOLECULE_STRING = args.molecule
+    MOLECULE = getattr(diatom.constants, MOLECULE_STRING)
+    N_MAX = args.n_max
+    # Basis the Hamiltonian is diagonalised in; only the lowest, N <= N_MAX, states are kept
+    N_BASIS = max(args.n_basis or N_MAX, N_MAX)
+
+    GAUSS = 1e-4 # T
+    B = parse_b_grid(args.b_grid) * GAUSS
+
+    # 'block' diagonalises each M_F block separately, 'dense' the full matrix, 'continuation'
+    # labels the first field then follows each eigenvector along B with `continuation_eigh`
+    DIAGONALISATION = args.diagonalisation
+    if DIAGONALISATION == 'continuation' and N_BASIS > N_MAX:
+        raise ValueError("continuation needs the full eigenvectors, so --n-basis must equal --n-max")
+    # Energy error in Hz below which the high field eigenpairs come from perturbation theory, see
+    # precompute_tools.paschen_back; None diagonalises every field exactly
+    PASCHEN_BACK = args.paschen_back
+    PASCHEN_BACK_STATE_TOL = args.paschen_back_state_tol
+    if PASCHEN_BACK is not None and (DIAGONALISATION != 'block' or N_BASIS > N_MAX):
+        raise ValueError("--paschen-back needs --diagonalisation block and --n-basis equal to --n-max")
+    # 'lapack' subset driver or 'lanczos' shift-invert, used when N_BASIS > N_MAX
+    SUBSET_METHOD = args.subset_method
+    # 'single' stores STATES and COUPLINGS_SPARSE at float32/complex64; everything is still computed in double
+    STORAGE_PRECISION = args.storage_precision
+    # 'block' stores only the M_F blocks of each eigenvector matrix, see precompute_tools.blocks
+    STATES_LAYOUT = args.states_layout
+    # Spread the per-edge kernels over all cores
+    PARALLEL = not args.serial
+    # Keep the store already in OUTPUT_DIR and only compute the fields B adds before and after its grid
+    EXTEND = args.extend
+    # Add fields to B where the moments or eigenvectors change quickly, see precompute_tools.refine
+    REFINE_GRID = args.refine_grid
+    if REFINE_GRID and EXTEND:
+        raise ValueError("a refined grid would add fields inside the stored one, so --refine-grid cannot --extend")
+
+    settings_string = f'{MOLECULE_STRING}NMax{N_MAX}'
+    OUTPUT_DIR = args.output or f'../precomputed/{settings_string}'
+
+    I1 = MOLECULE["I1"]
+    I2 = MOLECULE["I2"]
+    I1_D = round(2*MOLECULE["I1"])
+    I2_D = round(2*MOLECULE["I2"])
+
+    PER_MN = (I1_D+1)*(I2_D+1)
+    N_STATES = PER_MN * (N_MAX+1)**2
+
+    # Canonical label & sparse edge ordering
+    UNCOUPLED_LABELS_D = uncoupled_labels_d(N_MAX, I1_D, I2_D)
+
+    # Canonical numbering of states and edges, see precompute_tools.state_index
+    STATE_INDEX = state_index(N_MAX, I1_D, I2_D)
+
+    generated_labels = STATE_INDEX.labels_d
+    label_degeneracy_cache = STATE_INDEX.degeneracy
+    state_jump_list = STATE_INDEX.state_jump_list
+
+    generated_edge_labels = STATE_INDEX.edge_labels_d
+    generated_edge_indices = STATE_INDEX.edge_indices
+    edge_jump_list = STATE_INDEX.edge_jump_list
+
+    N_TRANSITIONS = len(generated_edge_labels)
+
+    INITIAL_STATE_LABELS_D = MOLECULE["StartStates_D"]
+    INITIAL_STATE_INDICES = [node_index(STATE_INDEX, *label_d) for label_d in INITIAL_STATE_LABELS_D]
+
+    # Diagonalise & calculate
+    H0,Hz,Hdc,Hac = operators.build_hamiltonians(N_BASIS, MOLECULE, zeeman=True, Edc=False, ac=False)
+    # The Zeeman-only Hamiltonian is real, so everything downstream (STATES included) stays float64
+    H0, Hz = real_if_symmetric(H0, Hz)
+
+    # The basis is ordered by N, so the kept N <= N_MAX states come first
+    BASIS_LABELS_D = uncoupled_labels_d(N_BASIS, I1_D, I2_D)
+    HZ_KEPT = Hz[:N_STATES,:N_STATES]
+
+    dipole_op_zero = operators.dipole(N_MAX,I1,I2,1,0)
+    dipole_op_minus = operators.dipole(N_MAX,I1,I2,1,-1)
+    dipole_op_plus = operators.dipole(N_MAX,I1,I2,1,+1)
+    DIPOLE_OPS = {0: dipole_op_zero, +1: dipole_op_plus, -1: dipole_op_minus}
+    EDGE_POLARISATION = edge_polarisations(edge_jump_list)
+
+    if DIAGONALISATION in ('block', 'continuation'):
+        MF_D_BLOCKS, UNCOUPLED_BLOCKS = mf_blocks(BASIS_LABELS_D)
+        check_block_diagonal(H0, UNCOUPLED_BLOCKS)
+        check_block_diagonal(Hz, UNCOUPLED_BLOCKS)
+        KEPT_PER_BLOCK = [int(np.sum(BASIS_LABELS_D[idx,0] <= N_MAX)) for idx in UNCOUPLED_BLOCKS] if N_BASIS > N_MAX else None
+
+    STATES_DTYPE = np.result_type(H0, Hz, np.double)
+    # M_F blocks of the kept N <= N_MAX basis, which the label tracker compares within
+    _, TRACKING_BLOCKS = mf_blocks(BASIS_LABELS_D[:N_STATES])
+
+    def diagonalise_fields(b_chunk):
+        """Eigenpairs at b_chunk, and how many M_F blocks at each field the Paschen-Back fast path left to eigh."""
+        if PASCHEN_BACK is not None:
+            energies, states, exact = paschen_back_eigh(H0, Hz, b_chunk, UNCOUPLED_BLOCKS, PASCHEN_BACK*scipy.constants.h,
+                                                        PASCHEN_BACK_STATE_TOL)
+            return energies, states, exact.sum(axis=1)
+        if DIAGONALISATION in ('block', 'continuation'):
+            energies, states = block_eigh(H0, Hz, b_chunk, UNCOUPLED_BLOCKS, n_lowest=KEPT_PER_BLOCK, method=SUBSET_METHOD)
+        else:
+            H = (
+                +H0[..., None]
+                +Hz[..., None]*b_chunk
+                ).transpose(2,0,1)
+            energies, states = eigh(H) if N_BASIS == N_MAX else lowest_eigh(H, N_STATES, SUBSET_METHOD)
+        # Drop the small N > N_MAX admixtures so everything downstream stays in the N_MAX basis
+        return energies, states[:,:N_STATES,:], np.zeros(len(b_chunk), dtype=int)
+
+    # BLAS, numba and every worker process share `--threads` cores. Each chunk of fields is split over worker
+    # processes with their BLAS threads pinned, as many threads each as the matrix size makes worthwhile; run
+    # `python -m precompute_tools.scheduler --size <largest block>` to time the alternatives and pass the best as
+    # `--eigh-split`. Continuation steps from field to field, so it runs in this process on all of them.
+    CORES = args.threads or available_cores()
+    EIGH_SIZE = max(len(idx) for idx in UNCOUPLED_BLOCKS) if DIAGONALISATION in ('block', 'continuation') else len(BASIS_LABELS_D)
+    SCHEDULER = EighScheduler(diagonalise_fields, EIGH_SIZE, CORES, split=(1, CORES) if DIAGONALISATION == 'continuation' else args.eigh_split)
+    # Processes for the shortest paths, forked now: once numba's parallel kernels have run, forking hangs the run at exit
+    WORKERS = (args.workers or CORES) if PARALLEL else 1
+    PATHS_POOL = fork_pool(WORKERS) if WORKERS > 1 else None
+    # The grid refinement diagonalises the kept M_F blocks on the same cores
+    REFINER = EighScheduler(partial(field_summaries, H0[:N_STATES,:N_STATES], HZ_KEPT, blocks=TRACKING_BLOCKS),
+                            max(len(idx) for idx in TRACKING_BLOCKS), CORES, split=args.eigh_split) if REFINE_GRID else None
+    limit_threads(CORES)
+    print(SCHEDULER)
+
+    def diagonalise(b_chunk):
+        energies, states, n_exact = SCHEDULER.map(b_chunk)
+        return energies, states, int(n_exact.sum())
+
+    # With `REFINE_GRID` the `--b-grid` steps are halved wherever a magnetic moment changes by more than
+    # `--refine-moment-tol` or an eigenvector by more than `--refine-state-tol` across them, which puts the fields
+    # where the moment crossings and avoided crossings are. Everything downstream looks fields up by value
+    # (`field_to_bi` is a nearest-neighbour search), so it works on the non-uniform grid as is.
+    # Its eigensolves go through `REFINER`, split over workers and threads like the diagonalisation, and the grid
+    # stops growing, with a warning, at `--refine-max-fields`.
+    if REFINE_GRID:
+        B_COARSE_STEPS = len(B)
+        B = refine_grid(REFINER.map, B, args.refine_moment_tol*scipy.constants.h/GAUSS, args.refine_state_tol,
+                        args.refine_min_step*GAUSS, args.refine_max_fields)
+        REFINER.close()
+        print(f"Refined the field grid from {B_COARSE_STEPS} to {len(B)} fields")
+
+    B_STEPS = len(B)
+
+    # Stream over the field grid in chunks of `CHUNK_STEPS`, writing each chunk straight into
+    # memory-mapped arrays in `OUTPUT_DIR`, so peak memory scales with the chunk rather than `B_STEPS`.
+    # Every chunk is checkpointed as soon as it is written, and so is every chunk of the later stages, so
+    # rerunning after a crash picks up where it stopped; pass `--restart` to start over instead.
+    # Only the first field is labelled; the rest of the grid is one segment followed outwards from it, each
+    # chunk smoothed starting from the last (already canonically ordered) field of the chunk before. With
+    # continuation every field starts from the eigenvectors of the one before, which keeps the canonical
+    # order without any smoothing.
+    #
+    # With `EXTEND` the fields of the stored grid are copied over instead of recomputed. The new fields after
+    # and before it are two segments, followed outwards from the stored end fields, whose labels are carried
+    # over by re-diagonalising there and matching to the stored eigenvectors.
+    def magnetic_moments(states):
+        return np.einsum('bji,jk,bki->ib', states.conj(), -HZ_KEPT, states, optimize='optimal')
+
+    def moments_and_couplings(values):
+        """Magnetic moments and edge couplings from eigenvectors laid out as STATES stores them.
+
+        With the block layout these work one M_F block at a time and never form the dense S x S matrices.
+        """
+        if STATES_LAYOUT == 'block':
+            return (BLOCK_LAYOUT.magnetic_moments(values, HZ_KEPT),
+                    BLOCK_LAYOUT.edge_couplings(values, DIPOLE_OPS, generated_edge_indices, EDGE_POLARISATION))
+        return magnetic_moments(values), edge_couplings(values, DIPOLE_OPS, generated_edge_indices, EDGE_POLARISATION)
+
+    def read_states(b):
+        return BLOCK_LAYOUT.expand(STATES[b]) if STATES_LAYOUT == 'block' else STATES[b]
+
+    def follow(b_chunk, energies_prev, states_prev):
+        """Canonically ordered eigenpairs at b_chunk, continuing from those at the field just before it."""
+        if DIAGONALISATION == 'continuation':
+            return continuation_eigh(H0, Hz, b_chunk, UNCOUPLED_BLOCKS, states_prev)
+        energies_chunk, states_chunk, n_exact = diagonalise(b_chunk)
+        energies_chunk = np.concatenate([energies_prev[None,:], energies_chunk])
+        states_chunk = np.concatenate([states_prev[None,:,:], states_chunk])
+        energies_chunk, states_chunk = track_states(energies_chunk, states_chunk, TRACKING_BLOCKS)
+        return energies_chunk[1:], states_chunk[1:], n_exact
+
+    def write_chunk(b_start, b_stop, energies_chunk, states_chunk):
+        ENERGIES[:,b_start:b_stop] = energies_chunk.T
+        values = BLOCK_LAYOUT.compress(states_chunk) if STATES_LAYOUT == 'block' else states_chunk # still at full precision
+        STATES[b_start:b_stop] = values
+        MAGNETIC_MOMENTS[:,b_start:b_stop], COUPLINGS_SPARSE[:,b_start:b_stop] = moments_and_couplings(values)
+        MOMENT_SLOPES[:,b_start:b_stop], MOMENT_CURVATURES[:,b_start:b_stop] = moment_derivatives(energies_chunk, states_chunk, HZ_KEPT)
+
+        if STORAGE_PRECISION != 'double':
+            # Compare what a consumer computes from the stored states with the double precision values
+            sample = np.arange(b_start, b_stop, VALIDATION_STRIDE)
+            exact_states = states_chunk[sample-b_start]
+            exact_couplings = edge_couplings(exact_states, DIPOLE_OPS, generated_edge_indices, EDGE_POLARISATION)
+            stored_moments, stored_couplings = moments_and_couplings(np.asarray(STATES[sample]))
+            PRECISION_REPORT.update('states', read_states(sample), exact_states)
+            PRECISION_REPORT.update('magnetic_moments', stored_moments, MAGNETIC_MOMENTS[:,sample])
+            PRECISION_REPORT.update('couplings', COUPLINGS_SPARSE[:,sample], exact_couplings)
+            PRECISION_REPORT.update('couplings_from_states', stored_couplings, exact_couplings)
+            VALIDATION_FIELDS.append(sample)
+            VALIDATION_COUPLINGS.append(exact_couplings)
+
+    # Everything the outputs depend on; a checkpoint left by a run with other inputs is never resumed
+    CHECKPOINT = Checkpoint(OUTPUT_DIR, {k: v for k, v in vars(args).items() if k not in ('serial', 'threads', 'eigh_split', 'workers', 'memory', 'restart', 'output')},
+                            restart=args.restart)
+    RESUME = CHECKPOINT.resumed
+    # Fields between checkpoints of the per-edge stages
+    STAGE_CHUNK_STEPS = 1024
+
+    if EXTEND:
+        # The extended store is written in place of the old one, which is read from beside it until it is spliced in;
+        # if it is already there, an earlier extension was interrupted and it is still the store being extended
+        PREVIOUS_DIR = OUTPUT_DIR.rstrip('/') + '.previous'
+        PREVIOUS = load_store(PREVIOUS_DIR if os.path.isdir(PREVIOUS_DIR) else OUTPUT_DIR)
+        PREVIOUS_METADATA = PREVIOUS.manifest['metadata']
+        if (PREVIOUS_METADATA['molecule'], PREVIOUS_METADATA['n_max']) != (MOLECULE_STRING, N_MAX):
+            raise ValueError(f"{OUTPUT_DIR} holds {PREVIOUS_METADATA['molecule']} with N_MAX={PREVIOUS_METADATA['n_max']}")
+        if PREVIOUS_METADATA.get('storage_precision', 'double') != STORAGE_PRECISION or ('states' in PREVIOUS) != (STATES_LAYOUT == 'dense'):
+            raise ValueError("--storage-precision and --states-layout must match the store being extended")
+        B_PREVIOUS = np.asarray(PREVIOUS['b'])
+        B_OFFSET = int(np.argmin(np.abs(B - B_PREVIOUS[0])))
+        B_PREVIOUS_END = B_OFFSET + len(B_PREVIOUS)
+        if B_PREVIOUS_END > B_STEPS or not np.allclose(B[B_OFFSET:B_PREVIOUS_END], B_PREVIOUS, rtol=1e-12, atol=0):
+            raise ValueError("the new field grid must contain the stored one as a contiguous run")
+
+        if not os.path.isdir(PREVIOUS_DIR):
+            os.replace(OUTPUT_DIR, PREVIOUS_DIR)
+            PREVIOUS = load_store(PREVIOUS_DIR)
+        NEW_RANGES = [r for r in ((0, B_OFFSET), (B_PREVIOUS_END, B_STEPS)) if r[1] > r[0]]
+        # Followed outwards from the stored end fields: upwards after the stored grid, downwards before it
+        SEGMENT_FIELDS = [np.arange(B_PREVIOUS_END, B_STEPS), np.arange(B_OFFSET-1, -1, -1)]
+        SEGMENT_STARTS = [B_PREVIOUS_END-1, B_OFFSET]
+    else:
+        NEW_RANGES = [(0, B_STEPS)]
+        SEGMENT_FIELDS = [np.arange(1, B_STEPS)]
+        SEGMENT_STARTS = [0]
+
+    # The usual diagonalise/track/couple working set, plus the moment derivatives' temporaries
+    CHUNK_STEPS = chunk_steps_for_memory(len(BASIS_LABELS_D), args.memory, working_copies=8+MOMENT_WORKING_COPIES)
+
+    ENERGIES = open_output(OUTPUT_DIR, 'energies', (N_STATES,B_STEPS), np.double, resume=RESUME)
+    if STATES_LAYOUT == 'block':
+        BLOCK_LAYOUT = BlockLayout.from_labels(BASIS_LABELS_D[:N_STATES], generated_labels)
+        STATES = open_output(OUTPUT_DIR, 'states_blocks', (B_STEPS,BLOCK_LAYOUT.n_values), storage_dtype(STATES_DTYPE, STORAGE_PRECISION), resume=RESUME)
+        STATES_ARRAYS = {'states_blocks': STATES, **BLOCK_LAYOUT.arrays()}
+    else:
+        STATES = open_output(OUTPUT_DIR, 'states', (B_STEPS,N_STATES,N_STATES), storage_dtype(STATES_DTYPE, STORAGE_PRECISION), resume=RESUME) #[b,uncoupled,coupled]
+        STATES_ARRAYS = {'states': STATES}
+    MAGNETIC_MOMENTS = open_output(OUTPUT_DIR, 'magnetic_moments', (N_STATES,B_STEPS), STATES_DTYPE, resume=RESUME)
+    # dmu/dB and d2mu/dB2 from perturbation sums at each field, see precompute_tools.moments
+    MOMENT_SLOPES = open_output(OUTPUT_DIR, 'magnetic_moment_slopes', (N_STATES,B_STEPS), np.double, resume=RESUME)
+    MOMENT_CURVATURES = open_output(OUTPUT_DIR, 'magnetic_moment_curvatures', (N_STATES,B_STEPS), np.double, resume=RESUME)
+    COUPLINGS_SPARSE = open_output(OUTPUT_DIR, 'couplings_sparse', (N_TRANSITIONS,B_STEPS), storage_dtype(np.double, STORAGE_PRECISION), resume=RESUME)
+
+    VALIDATION_STRIDE = 10 # fields between checks of the reduced precision storage
+    VALIDATION_FIELDS, VALIDATION_COUPLINGS = [], []
+    PRECISION_REPORT = PrecisionReport()
+    if EXTEND:
+        PRECISION_REPORT.errors.update(PREVIOUS_METADATA.get('precision_errors', {}))
+    # Only the worst case so far survives a restart; the gate time check covers the fields validated since
+    PRECISION_REPORT.errors.update(CHECKPOINT.value('precision_errors', {}))
+    N_FALLBACKS = CHECKPOINT.value('n_fallbacks', 0)
+
+    if EXTEND and not CHECKPOINT.done_fields('copy'):
+        for name, array in (('energies', ENERGIES), ('magnetic_moments', MAGNETIC_MOMENTS), ('couplings_sparse', COUPLINGS_SPARSE)):
+            copy_fields(PREVIOUS[name], array, B_OFFSET)
+            array.flush()
+        copy_fields(PREVIOUS[next(iter(STATES_ARRAYS))], STATES, B_OFFSET, axis=0)
+        STATES.flush()
+        if 'magnetic_moment_slopes' in PREVIOUS:
+            for name, array in (('magnetic_moment_slopes', MOMENT_SLOPES), ('magnetic_moment_curvatures', MOMENT_CURVATURES)):
+                copy_fields(PREVIOUS[name], array, B_OFFSET)
+        else:
+            # Stored before the moment derivatives were: work them out from the stored eigenpairs
+            for start, stop in chunk_bounds(B_PREVIOUS_END - B_OFFSET, CHUNK_STEPS):
+                b = slice(B_OFFSET+start, B_OFFSET+stop)
+                states = np.asarray(read_states(b), dtype=STATES_DTYPE)
+                MOMENT_SLOPES[:,b], MOMENT_CURVATURES[:,b] = moment_derivatives(ENERGIES[:,b].T, states, HZ_KEPT)
+        MOMENT_SLOPES.flush()
+        MOMENT_CURVATURES.flush()
+        CHECKPOINT.advance('copy', B_PREVIOUS_END - B_OFFSET)
+
+    def segment_start(b):
+        """Canonically ordered eigenpairs at field b, the one a segment continues from."""
+        energies_chunk, states_chunk, _ = diagonalise(B[b:b+1])
+        if EXTEND:
+            # Carry the stored labels over by matching to the stored eigenvectors there
+            return reconcile_columns(energies_chunk[0], states_chunk[0], ENERGIES[:,b], read_states(b))
+
+        # Label at the first field from the M_F blocks and the ordering within them
+        labels_d = block_labels_d(energies_chunk[0], states_chunk[0], BASIS_LABELS_D[:N_STATES], TRACKING_BLOCKS)
+        canonical_to_energy_map = canonical_order(labels_d, generated_labels)
+
+        energies_chunk = energies_chunk[:,canonical_to_energy_map]
+        states_chunk = states_chunk[:,:,canonical_to_energy_map]
+        write_chunk(b, b+1, energies_chunk, states_chunk)
+        return energies_chunk[0], states_chunk[0]
+
+    for segment, (fields, b_first) in enumerate(zip(SEGMENT_FIELDS, SEGMENT_STARTS)):
+        name = f'segment{segment}'
+        if not len(fields):
+            continue
+        if CHECKPOINT.has_arrays(name):
+            saved = CHECKPOINT.load_arrays(name)
+            fields_done, energies_prev, states_prev = int(saved['fields_done']), saved['energies'], saved['states']
+        else:
+            fields_done, (energies_prev, states_prev) = 0, segment_start(b_first)
+
+        for start, stop in tqdm(chunk_bounds(len(fields) - fields_done, CHUNK_STEPS)):
+            b_chunk = fields[fields_done+start:fields_done+stop]
+            energies_chunk, states_chunk, n_fallbacks = follow(B[b_chunk], energies_prev, states_prev)
+            N_FALLBACKS += n_fallbacks
+            energies_prev, states_prev = energies_chunk[-1], states_chunk[-1] # kept at full precision, whatever STATES is stored at
+
+            # Segments before the stored grid run towards lower fields
+            ascending = np.argsort(b_chunk)
+            write_chunk(b_chunk[ascending[0]], b_chunk[ascending[-1]]+1, energies_chunk[ascending], states_chunk[ascending])
+
+            # Outputs first, then where to carry on from, then the progress that relies on both
+            for array in (ENERGIES, STATES, MAGNETIC_MOMENTS, MOMENT_SLOPES, MOMENT_CURVATURES, COUPLINGS_SPARSE):
+                array.flush()
+            CHECKPOINT.save_arrays(name, fields_done=fields_done+stop, energies=energies_prev, states=states_prev)
+            CHECKPOINT.advance(name, stop-start, precision_errors=PRECISION_REPORT.errors, n_fallbacks=N_FALLBACKS)
+
+    SCHEDULER.close()
+
+    if DIAGONALISATION == 'continuation':
+        print(f"Continuation fell back to a full diagonalisation for {N_FALLBACKS} (field, M_F block) pairs")
+    if PASCHEN_BACK is not None:
+        print(f"Paschen-Back perturbation theory fell back to a full diagonalisation for {N_FALLBACKS} of "
+              f"{sum(map(len, SEGMENT_FIELDS))*len(UNCOUPLED_BLOCKS)} (field, M_F block) pairs")
+
+    # Optimise for t_gate in each transition
+    T_G_UNPOL = open_output(OUTPUT_DIR, 'transition_gate_times_unpol', (N_TRANSITIONS,B_STEPS), np.double, resume=RESUME)
+    T_G_POL = open_output(OUTPUT_DIR, 'transition_gate_times_pol', (N_TRANSITIONS,B_STEPS), np.double, resume=RESUME)
+
+    # Calculate Omegas for each pair
+    OMEGAS = open_output(OUTPUT_DIR, 'pair_resonance', (N_TRANSITIONS,B_STEPS), np.double, resume=RESUME)
+
+    # Both are filled by one batched kernel over every edge and (new) field.
+    for b_start, b_stop in CHECKPOINT.remaining('transition_tables', NEW_RANGES, STAGE_CHUNK_STEPS):
+        transition_tables(ENERGIES[:,b_start:b_stop], COUPLINGS_SPARSE[:,b_start:b_stop], generated_labels, generated_edge_indices, edge_jump_list,
+                          parallel=PARALLEL, t_g_unpol=T_G_UNPOL[:,b_start:b_stop], t_g_pol=T_G_POL[:,b_start:b_stop], omegas=OMEGAS[:,b_start:b_stop])
+        for array in (T_G_UNPOL, T_G_POL, OMEGAS):
+            array.flush()
+        CHECKPOINT.advance('transition_tables', b_stop-b_start)
+    if EXTEND and not CHECKPOINT.done_fields('copy_tables'):
+        for name, array in (('transition_gate_times_unpol', T_G_UNPOL), ('transition_gate_times_pol', T_G_POL), ('pair_resonance', OMEGAS)):
+            copy_fields(PREVIOUS[name], array, B_OFFSET)
+            array.flush()
+        CHECKPOINT.advance('copy_tables', B_PREVIOUS_END - B_OFFSET)
+
+    if STORAGE_PRECISION != 'double' and VALIDATION_FIELDS:
+        VALIDATION_FIELDS = np.concatenate(VALIDATION_FIELDS)
+        exact_t_g_unpol, exact_t_g_pol, _ = transition_tables(ENERGIES[:,VALIDATION_FIELDS], np.concatenate(VALIDATION_COUPLINGS, axis=1),
+                                                              generated_labels, generated_edge_indices, edge_jump_list, parallel=PARALLEL)
+        PRECISION_REPORT.update('t_g_unpol', T_G_UNPOL[:,VALIDATION_FIELDS], exact_t_g_unpol, elementwise=True)
+        PRECISION_REPORT.update('t_g_pol', T_G_POL[:,VALIDATION_FIELDS], exact_t_g_pol, elementwise=True)
+        print(f"Worst-case relative error from {STORAGE_PRECISION} precision storage:\n{PRECISION_REPORT}")
+
+    # Path from initial to any state
+    SHORTEST_PATHS = ShortestPaths(generated_edge_indices, N_STATES)
+
+    cumulative_unpol_fidelity_from_initials = open_output(OUTPUT_DIR, 'cumulative_unpol_time_from_initials', (N_STATES,B_STEPS), np.double, resume=RESUME)
+    predecessor_unpol_fidelity_from_initials = open_output(OUTPUT_DIR, 'predecessor_unpol_time_from_initials', (N_STATES,B_STEPS), int, resume=RESUME)
+    cumulative_pol_fidelity_from_initials = open_output(OUTPUT_DIR, 'cumulative_pol_time_from_initials', (N_STATES,B_STEPS), np.double, resume=RESUME)
+    predecessor_pol_fidelity_from_initials = open_output(OUTPUT_DIR, 'predecessor_pol_time_from_initials', (N_STATES,B_STEPS), int, resume=RESUME)
+    PATH_TABLES = {
+        'cumulative_unpol_time_from_initials': cumulative_unpol_fidelity_from_initials,
+        'predecessor_unpol_time_from_initials': predecessor_unpol_fidelity_from_initials,
+        'cumulative_pol_time_from_initials': cumulative_pol_fidelity_from_initials,
+        'predecessor_pol_time_from_initials': predecessor_pol_fidelity_from_initials,
+    }
+
+    for b_start, b_stop in CHECKPOINT.remaining('shortest_paths', NEW_RANGES, STAGE_CHUNK_STEPS):
+        cumulative_unpol_fidelity_from_initials[:,b_start:b_stop], predecessor_unpol_fidelity_from_initials[:,b_start:b_stop] = SHORTEST_PATHS.from_sources(T_G_UNPOL[:,b_start:b_stop], INITIAL_STATE_INDICES, workers=WORKERS, pool=PATHS_POOL)
+        cumulative_pol_fidelity_from_initials[:,b_start:b_stop], predecessor_pol_fidelity_from_initials[:,b_start:b_stop] = SHORTEST_PATHS.from_sources(T_G_POL[:,b_start:b_stop], INITIAL_STATE_INDICES, workers=WORKERS, pool=PATHS_POOL)
+        for array in PATH_TABLES.values():
+            array.flush()
+        CHECKPOINT.advance('shortest_paths', b_stop-b_start)
+    if PATHS_POOL is not None:
+        PATHS_POOL.shutdown()
+    if EXTEND and not CHECKPOINT.done_fields('copy_paths'):
+        for name, array in PATH_TABLES.items():
+            copy_fields(PREVIOUS[name], array, B_OFFSET)
+            array.flush()
+        CHECKPOINT.advance('copy_paths', B_PREVIOUS_END - B_OFFSET)
+
+    # Save to files
+    save_store(OUTPUT_DIR,
+               metadata = {'molecule': MOLECULE_STRING, 'n_max': N_MAX, 'storage_precision': STORAGE_PRECISION,
+                           'precision_errors': PRECISION_REPORT.errors},
+               b = B,
+               energies = ENERGIES,
+               **STATES_ARRAYS,
+
+               uncoupled_labels_d = UNCOUPLED_LABELS_D,
+
+               labels_d = generated_labels,
+               labels_degeneracy = label_degeneracy_cache,
+               state_jump_list = state_jump_list,
+
+               transition_labels_d = generated_edge_labels,
+               transition_indices = generated_edge_indices,
+               edge_jump_list = edge_jump_list,
+
+               magnetic_moments = MAGNETIC_MOMENTS,
+               magnetic_moment_slopes = MOMENT_SLOPES,
+               magnetic_moment_curvatures = MOMENT_CURVATURES,
+
+               couplings_sparse = COUPLINGS_SPARSE,
+               transition_gate_times_pol = T_G_POL,
+               transition_gate_times_unpol = T_G_UNPOL,
+
+               pair_resonance = OMEGAS,
+
+               **PATH_TABLES,
+               )
+
+    CHECKPOINT.clear()
+    if EXTEND:
+        shutil.rmtree(PREVIOUS_DIR)
+
+    return OUTPUT_DIR
+
+
+def main(argv=None):
+    precompute(precompute_arguments(argv))
+
+
+if __name__ == '__main__':
+    main()
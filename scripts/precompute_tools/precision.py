@@ -0,0 +1,41 @@
+import numpy as np
+
+# Real and complex dtype used to store the large tables at each precision
+PRECISIONS = {
+    'double': (np.float64, np.complex128),
+    'single': (np.float32, np.complex64),
+}
+
+
+def storage_dtype(dtype, precision):
+    """dtype to store an array of `dtype` with at the given precision ('double' or 'single')."""
+    real, complex_ = PRECISIONS[precision]
+    return np.dtype(complex_ if np.issubdtype(dtype, np.complexfloating) else real)
+
+
+class PrecisionReport:
+    """Worst-case error of each stored quantity against its double precision value.
+
+    Errors are accumulated chunk by chunk, so only the running maximum is kept.
+    'normwise' errors are max|approx - exact| / max|exact| over each update,
+    which suits states and couplings whose small elements carry no meaning on
+    their own; 'elementwise' errors are the largest relative error of any
+    finite element, which is what matters for gate times.
+    """
+
+    def __init__(self):
+        self.errors = {}
+
+    def update(self, name, approx, exact, elementwise=False):
+        approx = np.asarray(approx)
+        exact = np.asarray(exact)
+        if elementwise:
+            finite = np.isfinite(exact) & np.isfinite(approx) & (exact != 0)
+            error = np.max(np.abs(approx[finite] - exact[finite]) / np.abs(exact[finite]), initial=0.0)
+        else:
+            scale = np.max(np.abs(exact), initial=0.0)
+            error = np.max(np.abs(approx - exact), initial=0.0) / scale if scale > 0 else 0.0
+        self.errors[name] = max(self.errors.get(name, 0.0), float(error))
+
+    def __str__(self):
+        return '\n'.join(f"{name:>20}: {error:.3e}" for name, error in self.errors.items())
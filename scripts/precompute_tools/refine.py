@@ -0,0 +1,103 @@
+"""Adaptive refinement of the field grid.
+
+A hand-tuned grid is dense where nothing happens and too coarse at the
+narrow features the optimiser picks: moment crossings and avoided crossings.
+`refine_grid` starts from a coarse grid and keeps halving the steps where
+
+* any magnetic moment changes by more than `moment_tol` across the step,
+  from the moments at both ends and from their analytic slopes
+  dmu_i/dB = -2 sum_j |V_ij|^2 / (E_i - E_j), see `moments`. This bounds the
+  change of every moment difference too, so moment coincidences are resolved;
+* any eigenvector turns by more than `state_tol` across the step, from
+  |d psi_i/dB|^2 = sum_j |V_ij|^2 / (E_i - E_j)^2. The couplings follow the
+  eigenvectors, so this resolves avoided crossings.
+
+Eigenpairs are taken in each M_F block with the states in energy order, which
+within a block has no true crossings, so the moments at the two ends of a step
+belong to the same adiabatic state. Only the per-field summaries are kept, so
+the memory this needs scales with the grid and not with its eigenvectors.
+
+Tolerances far below what the Hamiltonian resolves would halve steps without
+end, so the grid stops growing at `max_fields`, spending the fields left on
+the steps furthest over the tolerances, and warns that it did.
+"""
+import warnings
+
+import numpy as np
+from numpy.linalg import eigh
+
+# Default cap on the refined grid, ~14x the default --b-grid
+MAX_FIELDS = 20000
+
+
+def field_summaries(H0, Hz, B, blocks):
+    """Magnetic moments of the adiabatic states in each block, and how fast they and the states change.
+
+    Returns:
+        moments (numpy.ndarray): B x S magnetic moments, block by block in energy order
+        moment_rates (numpy.ndarray): B, largest |dmu_i/dB|
+        state_rates (numpy.ndarray): B, largest |d psi_i/dB|
+    """
+    moments, moment_rates, state_rates = [], np.zeros(len(B)), np.zeros(len(B))
+    for idx in blocks:
+        sub = np.ix_(idx, idx)
+        energies, states = eigh(H0[sub] + Hz[sub]*B[:, None, None])
+        V = states.conj().transpose(0, 2, 1) @ Hz[sub] @ states
+        gaps = energies[:, :, None] - energies[:, None, :]
+        W = np.divide(V, gaps, out=np.zeros_like(V), where=gaps != 0)
+
+        moments.append(-np.einsum('bii->bi', V).real)
+        moment_rates = np.maximum(moment_rates, np.abs(2*np.einsum('bij,bij->bi', V.conj(), W).real).max(axis=1))
+        state_rates = np.maximum(state_rates, np.sqrt(np.einsum('bij,bij->bi', W.conj(), W).real).max(axis=1))
+    return np.concatenate(moments, axis=1), moment_rates, state_rates
+
+
+def refine_grid(summarise, B, moment_tol, state_tol, min_step, max_fields=MAX_FIELDS, chunk=1024):
+    """B with midpoints added until every step passes the tolerances or is down to min_step.
+
+    Args:
+        summarise (callable): summarise(b) -> `field_summaries` at the fields b, e.g. the `map` of an
+            `scheduler.EighScheduler` running `field_summaries` with the Hamiltonians and blocks bound
+        B (numpy.ndarray): ascending coarse grid; every field of it is kept
+        moment_tol (float): largest change of any magnetic moment across one step, in the units of Hz (energy per field)
+        state_tol (float): largest change of any eigenvector across one step
+        min_step (float): steps are never halved below this
+        max_fields (int): stop refining once the grid is this large, with a warning
+        chunk (int): fields summarised at once, bounds the memory of the eigenvectors
+    Returns:
+        B (numpy.ndarray): ascending refined grid
+    """
+    def summaries(b):
+        parts = [summarise(b[i:i+chunk]) for i in range(0, len(b), chunk)]
+        return tuple(np.concatenate(part) for part in zip(*parts))
+
+    B = np.asarray(B, dtype=np.double)
+    moments, moment_rates, state_rates = summaries(B)
+    while True:
+        steps = np.diff(B)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            excess = np.maximum(steps*np.maximum(moment_rates[:-1], moment_rates[1:])/moment_tol,
+                                steps*np.maximum(state_rates[:-1], state_rates[1:])/state_tol)
+        excess = np.maximum(excess, np.abs(np.diff(moments, axis=0)).max(axis=1)/moment_tol)
+        split = np.flatnonzero((excess > 1) & (steps >= 2*min_step))
+        if not len(split):
+            return B
+
+        room = max_fields - len(B)
+        capped = len(split) > room
+        if capped:
+            warnings.warn(f"refine_grid stopped at max_fields={max_fields}: {len(split) - max(room, 0)} steps are still "
+                          f"up to {excess[split].max():.3g}x over the tolerances; raise max_fields or the tolerances",
+                          RuntimeWarning, stacklevel=2)
+            if room <= 0:
+                return B
+            split = np.sort(split[np.argsort(excess[split])[-room:]])
+
+        middle = (B[split] + B[split+1])/2
+        new_moments, new_moment_rates, new_state_rates = summaries(middle)
+        B = np.insert(B, split+1, middle)
+        moments = np.insert(moments, split+1, new_moments, axis=0)
+        moment_rates = np.insert(moment_rates, split+1, new_moment_rates)
+        state_rates = np.insert(state_rates, split+1, new_state_rates)
+        if capped:
+            return B
@@ -0,0 +1,170 @@
+"""Spread batched diagonalisation over processes with a fixed thread budget.
+
+LAPACK's `eigh` barely speeds up with more threads for the small M_F blocks
+precompute diagonalises, but gains for the large dense matrices, and left to
+itself every BLAS uses every core. An `EighScheduler` owns `cores` cores and
+splits them into `workers` processes of `threads` BLAS threads each, then
+hands each worker a contiguous run of fields. The split and the fields per
+task follow from the matrix size; `benchmark` times every split on random
+matrices of that size instead, to check or override the default:
+
+    python -m precompute_tools.scheduler --size 576 --fields 512
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from numba import config as numba_config, set_num_threads
+from threadpoolctl import threadpool_limits
+
+# Below this many rows a LAPACK eigh gains nothing from a second thread
+ROWS_PER_THREAD = 256
+# Fewest flops of eigh worth a round trip to a worker, ~10 ms
+MIN_TASK_FLOPS = 1e8
+
+_FUNCTION = None
+
+
+def available_cores():
+    """Cores this process may run on, which can be fewer than the machine has."""
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+
+def limit_threads(threads):
+    """Limit BLAS/OpenMP and numba in this process to `threads` threads, for good."""
+    threadpool_limits(limits=threads)
+    set_num_threads(max(1, min(threads, numba_config.NUMBA_NUM_THREADS)))
+
+
+def default_split(size, cores):
+    """(workers, threads) for eigh of size x size matrices on `cores` cores."""
+    threads = 1
+    while 2*threads <= min(cores, size // ROWS_PER_THREAD):
+        threads *= 2
+    return max(1, cores // threads), threads
+
+
+def task_fields(size):
+    """Fewest fields per task for eigh of size x size matrices to outweigh the inter-process overhead."""
+    return max(1, int(np.ceil(MIN_TASK_FLOPS / (10*size**3))))
+
+
+def fork_pool(workers, initializer=None, initargs=()):
+    """ProcessPoolExecutor of `workers` processes, all forked before this returns.
+
+    Always forked, whatever the platform default: workers inherit the parent's state, where spawn or
+    forkserver would re-run the notebook-style __main__ script in each of them. Neither numba's parallel
+    thread pool nor TBB survive a fork (the parent hangs at exit), so pools are started before the first
+    parallel kernel runs and kept for the whole run.
+    """
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs,
+                               mp_context=multiprocessing.get_context('fork'))
+    pool.submit(int).result()
+    return pool
+
+
+def _start_worker(function, threads):
+    global _FUNCTION
+    _FUNCTION = function
+    limit_threads(threads)
+
+
+def _call(b):
+    return _FUNCTION(b)
+
+
+class EighScheduler:
+    """Run a function of a field chunk on `workers` processes of `threads` BLAS threads each.
+
+    Args:
+        function (callable): function(b) of an array of fields, returning a tuple of arrays with one row per
+            field; the workers inherit it when they fork, so it can close over anything, e.g. the Hamiltonians
+        size (int): rows of the largest matrix diagonalised, picks the default split and task size
+        cores (int): cores to use in all, every available core if None
+        split (tuple): (workers, threads) to use instead of `default_split`, e.g. from `benchmark`
+    """
+
+    def __init__(self, function, size, cores=None, split=None):
+        self.function = function
+        self.cores = cores or available_cores()
+        self.workers, self.threads = split or default_split(size, self.cores)
+        self.task_fields = task_fields(size)
+        self._pool = None
+        if self.workers > 1:
+            # Forked now, so the workers inherit `function` before any numba kernel has run
+            self._pool = fork_pool(self.workers, _start_worker, (function, self.threads))
+
+    def __repr__(self):
+        return f"EighScheduler({self.workers} workers x {self.threads} threads, >= {self.task_fields} fields per task)"
+
+    def map(self, b):
+        """function(b), computed in pieces and joined along the leading (field) axis."""
+        n_tasks = min(self.workers, len(b) // self.task_fields)
+        if n_tasks <= 1:
+            return self.function(b)
+        results = list(self._pool.map(_call, np.array_split(b, n_tasks)))
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def _random_eigh(b, size=None, seed=0):
+    h = np.random.default_rng(seed).standard_normal((size, size))
+    h = h + h.T
+    energies = np.empty((len(b), size))
+    states = np.empty((len(b), size, size))
+    for i, field in enumerate(b):
+        energies[i], states[i] = np.linalg.eigh(h + field*np.eye(size))
+    return energies, states
+
+
+def benchmark(size, n_fields, cores=None, repeats=2):
+    """Time `n_fields` eigh of size x size on every power-of-two split of `cores`.
+
+    Returns:
+        timings (dict): (workers, threads) -> best seconds per field
+    """
+    cores = cores or available_cores()
+    b = np.linspace(0, 1, n_fields)
+    timings = {}
+    threads = 1
+    while threads <= cores:
+        scheduler = EighScheduler(partial(_random_eigh, size=size), size, cores, split=(cores // threads, threads))
+        threadpool_limits(limits=threads) # for the in-process run of a single worker
+        scheduler.map(b[:scheduler.workers*scheduler.task_fields]) # warm up
+        best = np.inf
+        for _ in range(repeats):
+            start = time.perf_counter()
+            scheduler.map(b)
+            best = min(best, time.perf_counter() - start)
+        scheduler.close()
+        timings[(scheduler.workers, scheduler.threads)] = best / n_fields
+        threads *= 2
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the fastest split of cores between eigh processes and BLAS threads.")
+    parser.add_argument('--size', type=int, required=True, help="matrix rows, e.g. the largest M_F block")
+    parser.add_argument('--fields', type=int, default=512, help="matrices to diagonalise per timing")
+    parser.add_argument('--cores', type=int, default=None, help="cores to split (default: all available)")
+    args = parser.parse_args(argv)
+
+    timings = benchmark(args.size, args.fields, args.cores)
+    default = default_split(args.size, args.cores or available_cores())
+    for (workers, threads), seconds in timings.items():
+        marks = ' (default)' if (workers, threads) == default else ''
+        print(f"{workers:4d} workers x {threads:3d} threads: {1e3*seconds:9.3f} ms per field{marks}")
+    workers, threads = min(timings, key=timings.get)
+    print(f"best: --eigh-split {workers} {threads}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Canonical state and edge numbering, shared by precompute and its consumers.
+
+States are numbered by N, then MF_D, then d; the edges out of each state are
+laid out in six sections, (dN, dMF_D) = (+1, 0), (+1, -2), (+1, +2), (-1, 0),
+(-1, +2), (-1, -2), each holding one edge per degenerate target state. All
+lookups are O(1) arithmetic on the tables of a `StateIndex`, which is a plain
+namedtuple of arrays so it can be passed to (or closed over by) @njit code.
+"""
+from collections import namedtuple
+
+import numpy as np
+from numba import njit
+
+from .eigen import mf_d_of_uncoupled, uncoupled_labels_d
+
+# (dN, dMF_D) of the six edge sections, in edge_jump_list order
+EDGE_SECTIONS = np.array([(+1, 0), (+1, -2), (+1, +2), (-1, 0), (-1, +2), (-1, -2)])
+
+StateIndex = namedtuple('StateIndex', [
+    'n_max', 'f_d_max',
+    'labels_d',          # S x 3 (N, MF_D, d) in canonical order
+    'degeneracy',        # (N_MAX+1) x (F_D_MAX+1) number of states with each (N, MF_D)
+    'state_jump_list',   # (N_MAX+1) x (F_D_MAX+1) index of (N, MF_D, 0)
+    'edge_labels_d',     # E x 6 (N, MF_D, d, N', MF_D', d')
+    'edge_indices',      # E x 2 (from, to) state indices
+    'edge_jump_list',    # S x 7 first edge of each section, and the next state's first edge
+])
+
+
+def state_index(n_max, I1_D, I2_D):
+    """Build the canonical tables for a molecule with nuclear spins I1_D/2, I2_D/2 up to N = n_max."""
+    f_d_max = 2*n_max + I1_D + I2_D
+
+    # Count uncoupled states per (N, MF_D), then number (N, MF_D, d) in order
+    uncoupled = uncoupled_labels_d(n_max, I1_D, I2_D)
+    degeneracy = np.zeros((n_max+1, f_d_max+1), dtype=int)
+    np.add.at(degeneracy, (uncoupled[:, 0], (mf_d_of_uncoupled(uncoupled)+f_d_max)//2), 1)
+    counts = degeneracy.ravel()
+    starts = np.cumsum(counts) - counts
+    state_jump_list = np.where(degeneracy > 0, starts.reshape(degeneracy.shape), 0)
+
+    n_of, mf_index_of = np.divmod(np.repeat(np.arange(len(counts)), counts), f_d_max+1)
+    labels_d = np.stack([n_of, 2*mf_index_of - f_d_max, np.arange(counts.sum()) - np.repeat(starts, counts)], axis=1)
+
+    # Edge counts per (state, section) give edge_jump_list; edges then follow by repetition
+    target_n = labels_d[:, 0, None] + EDGE_SECTIONS[None, :, 0]
+    target_mf_d = labels_d[:, 1, None] + EDGE_SECTIONS[None, :, 1]
+    valid = (target_n >= 0) & (target_n <= n_max) & (np.abs(target_mf_d) <= 2*target_n + I1_D + I2_D)
+    target_n_clipped = np.clip(target_n, 0, n_max)
+    target_mf_index = np.clip((target_mf_d + f_d_max)//2, 0, f_d_max)
+    section_counts = np.where(valid, degeneracy[target_n_clipped, target_mf_index], 0).ravel()
+    section_starts = np.cumsum(section_counts) - section_counts
+    edge_jump_list = np.concatenate([section_starts.reshape(-1, 6), np.cumsum(section_counts).reshape(-1, 6)[:, -1:]],
+                                    axis=1)
+
+    n_edges = section_counts.sum()
+    section_of_edge = np.repeat(np.arange(len(section_counts)), section_counts)
+    from_index, section = np.divmod(section_of_edge, 6)
+    k = np.arange(n_edges) - section_starts[section_of_edge]
+    to_n = target_n_clipped.ravel()[section_of_edge]
+    to_mf_index = target_mf_index.ravel()[section_of_edge]
+    to_index = state_jump_list[to_n, to_mf_index] + k
+    edge_indices = np.stack([from_index, to_index], axis=1)
+    edge_labels_d = np.concatenate([labels_d[from_index], labels_d[to_index]], axis=1)
+
+    return StateIndex(n_max, f_d_max, labels_d, degeneracy, state_jump_list, edge_labels_d, edge_indices,
+                      edge_jump_list)
+
+
+def state_index_from_store(store):
+    """StateIndex over the tables saved by precompute, without rebuilding them."""
+    degeneracy = np.asarray(store['labels_degeneracy'])
+    return StateIndex(degeneracy.shape[0]-1, degeneracy.shape[1]-1, np.asarray(store['labels_d']), degeneracy,
+                      np.asarray(store['state_jump_list']), np.asarray(store['transition_labels_d']),
+                      np.asarray(store['transition_indices']), np.asarray(store['edge_jump_list']))
+
+
+@njit(cache=True)
+def degeneracy(index, N, MF_D):
+    """Number of states labelled (N, MF_D, d), zero for labels that do not exist.
+
+    Counts the (M_N, M_I1, M_I2) with 2 M_N + M_I1_D + M_I2_D = MF_D for any N and MF_D, as enumerating them
+    would: MF_D of the wrong parity has none, and beyond n_max the spin-only (N = 0) counts are summed over M_N.
+    """
+    if N < 0 or (MF_D + index.f_d_max) % 2 != 0:
+        return 0
+    if N <= index.n_max:
+        return index.degeneracy[N, (MF_D+index.f_d_max)//2] if abs(MF_D) <= index.f_d_max else 0
+    count = 0
+    for MN in range(-N, N+1):
+        spin_mf_d = MF_D - 2*MN
+        if abs(spin_mf_d) <= index.f_d_max:
+            count += index.degeneracy[0, (spin_mf_d+index.f_d_max)//2]
+    return count
+
+
+@njit(cache=True)
+def node_index(index, N, MF_D, d):
+    """Canonical index of the state labelled (N, MF_D, d)."""
+    return index.state_jump_list[N, (MF_D+index.f_d_max)//2] + d
+
+
+@njit(cache=True)
+def edge_section(dN, dMF_D):
+    """Section (0-5) of edge_jump_list holding edges that change N by dN and MF_D by dMF_D."""
+    return 3*(dN < 0) + (dN*(-dMF_D)//2) % 3
+
+
+@njit(cache=True)
+def edge_index(index, label1, label2):
+    """Index of the edge from the state labelled label1 to the one labelled label2."""
+    first_indices = index.edge_jump_list[node_index(index, label1[0], label1[1], label1[2])]
+    return first_indices[edge_section(label2[0] - label1[0], label2[1] - label1[1])] + label2[2]
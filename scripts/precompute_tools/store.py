@@ -0,0 +1,164 @@
+import json
+import os
+
+import numpy as np
+
+
+def chunk_bounds(n_steps, chunk_steps):
+    """(start, stop) pairs covering range(n_steps) in pieces of at most chunk_steps."""
+    return [(start, min(start+chunk_steps, n_steps)) for start in range(0, n_steps, chunk_steps)]
+
+
+def chunk_steps_for_memory(n_states, memory_bytes, itemsize=16, working_copies=8):
+    """Largest number of field points whose working set fits in memory_bytes.
+
+    Each field point holds a handful of S x S matrices at once while it is
+    being diagonalised, smoothed and coupled (Hamiltonian, eigenvectors, the
+    smoothing copy, and the transposed eigenvectors and dipole products used
+    for the edge couplings), which is what `working_copies` counts.
+    """
+    per_step = working_copies * itemsize * n_states**2
+    return max(1, int(memory_bytes // per_step))
+
+
+def open_output(directory, name, shape, dtype, resume=False):
+    """Preallocate a `.npy` file in `directory` and return it memory-mapped for writing.
+
+    With `resume`, a file of the same shape and dtype left by an interrupted run is
+    reopened as it is instead of being overwritten.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{name}.npy')
+    if resume and os.path.exists(path):
+        existing = np.load(path, mmap_mode='r+')
+        if existing.shape == tuple(shape) and existing.dtype == np.dtype(dtype):
+            return existing
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+def copy_fields(source, target, offset, axis=-1, chunk_steps=1024):
+    """Copy `source` into `target` starting at field `offset` along the field `axis`, a chunk of fields at a time."""
+    n_steps = source.shape[axis]
+    for start, stop in chunk_bounds(n_steps, chunk_steps):
+        index = [slice(None)]*source.ndim
+        index[axis] = slice(start, stop)
+        target_index = list(index)
+        target_index[axis] = slice(offset+start, offset+stop)
+        target[tuple(target_index)] = source[tuple(index)]
+
+
+class TiledArray:
+    """An [..., E, B] array stored in tiles along its last two axes.
+
+    On disk it is one `.npy` of shape (tiles along E, tiles along B, ..., tile_e,
+    tile_b), with the last tiles padded, so reading a line along either axis
+    only touches the tiles that line crosses instead of striding through the
+    whole file.
+    """
+
+    def __init__(self, tiles, shape):
+        self.tiles = tiles
+        self.shape = tuple(shape)
+        self.tile_e, self.tile_b = tiles.shape[-2:]
+        self.dtype = tiles.dtype
+
+    @classmethod
+    def create(cls, directory, name, shape, tile, dtype):
+        n_e, n_b = shape[-2:]
+        tile_e, tile_b = min(tile[0], n_e), min(tile[1], n_b)
+        tiles_shape = (-(-n_e//tile_e), -(-n_b//tile_b), *shape[:-2], tile_e, tile_b)
+        return cls(open_output(directory, name, tiles_shape, dtype), shape)
+
+    def write(self, e, b_start, values):
+        """Write values[..., :] into the line at E index e, starting at B index b_start."""
+        b_stop = b_start + values.shape[-1]
+        te, re = divmod(e, self.tile_e)
+        for tile_start in range(b_start - b_start % self.tile_b, b_stop, self.tile_b):
+            lo, hi = max(b_start, tile_start), min(b_stop, tile_start + self.tile_b)
+            self.tiles[te, tile_start//self.tile_b, ..., re, lo-tile_start:hi-tile_start] = values[..., lo-b_start:hi-b_start]
+
+    def __getitem__(self, key):
+        """arr[e, b] with e and b each an int or a slice, returning [..., e, b] as an array."""
+        e, b = key
+        es = np.arange(self.shape[-2])[e]
+        bs = np.arange(self.shape[-1])[b]
+        out = np.empty(self.shape[:-2] + (np.size(es), np.size(bs)), dtype=self.dtype)
+        es_flat, bs_flat = np.atleast_1d(es), np.atleast_1d(bs)
+        for te in np.unique(es_flat // self.tile_e):
+            e_in = np.flatnonzero(es_flat // self.tile_e == te)
+            for tb in np.unique(bs_flat // self.tile_b):
+                b_in = np.flatnonzero(bs_flat // self.tile_b == tb)
+                tile = self.tiles[te, tb]
+                out[..., e_in[:, None], b_in[None, :]] = \
+                    tile[..., (es_flat[e_in] % self.tile_e)[:, None], (bs_flat[b_in] % self.tile_b)[None, :]]
+        return out[..., 0 if np.ndim(es) == 0 else slice(None), 0 if np.ndim(bs) == 0 else slice(None)]
+
+    def flush(self):
+        self.tiles.flush()
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def save_store(directory, metadata=None, **arrays):
+    """Write a directory store: one uncompressed `.npy` per array plus a manifest.
+
+    Arrays that are already memory-mapped onto their target file (from
+    `open_output`) are only flushed, everything else is written with `numpy.save`.
+    The manifest is written last, so a store without one is incomplete.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = {'format': 1, 'metadata': metadata or {}, 'arrays': {}}
+    for name, array in arrays.items():
+        if isinstance(array, TiledArray):
+            manifest.setdefault('tiled', {})[name] = {'shape': list(array.shape)}
+            array = array.tiles
+        path = os.path.join(directory, f'{name}.npy')
+        if isinstance(array, np.memmap) and array.filename is not None and os.path.exists(path) \
+                and os.path.samefile(array.filename, path):
+            array.flush()
+        else:
+            np.save(path, array)
+        array = np.asanyarray(array)
+        manifest['arrays'][name] = {'shape': list(array.shape), 'dtype': array.dtype.str}
+    with open(os.path.join(directory, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+
+class Store:
+    """Read-only view of a directory store.
+
+    Indexing by name opens that array with `numpy.load(..., mmap_mode=...)`, so
+    nothing is read from disk until the rows are actually used. Arrays saved
+    as a `TiledArray` come back as one.
+    """
+
+    def __init__(self, directory, mmap_mode='r'):
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            self.manifest = json.load(f)
+
+    def keys(self):
+        return self.manifest['arrays'].keys()
+
+    def __contains__(self, name):
+        return name in self.manifest['arrays']
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(f"{name} is not in the store at {self.directory}")
+        array = np.load(os.path.join(self.directory, f'{name}.npy'), mmap_mode=self.mmap_mode)
+        if name in self.manifest.get('tiled', {}):
+            return TiledArray(array, self.manifest['tiled'][name]['shape'])
+        return array
+
+
+def load_store(directory, mmap_mode='r'):
+    """Open a directory store written by `save_store`.
+
+    Stores saved before precompute wrote `magnetic_moment_slopes` and
+    `magnetic_moment_curvatures` do not have them; readers of those fall back
+    to differencing `magnetic_moments` along the field axis.
+    """
+    return Store(directory, mmap_mode=mmap_mode)
@@ -0,0 +1,102 @@
+import numpy as np
+from numba import njit, prange
+from scipy.optimize import linear_sum_assignment
+
+
+def block_layout(blocks, n_states):
+    """Flatten a list of basis index arrays into (block_of_row, rows, offsets) for the compiled kernels."""
+    block_of_row = np.empty(n_states, dtype=np.int64)
+    for bi, idx in enumerate(blocks):
+        block_of_row[idx] = bi
+    rows = np.concatenate(blocks).astype(np.int64)
+    offsets = np.cumsum([0] + [len(idx) for idx in blocks]).astype(np.int64)
+    return block_of_row, rows, offsets
+
+
+@njit(cache=True)
+def _column_blocks(states, block_of_row):
+    # Block holding the largest component of each column
+    n_s, n_k = states.shape
+    out = np.empty(n_k, dtype=np.int64)
+    for c in range(n_k):
+        best = -1.0
+        best_row = 0
+        for r in range(n_s):
+            weight = states[r, c].real**2 + states[r, c].imag**2
+            if weight > best:
+                best = weight
+                best_row = r
+        out[c] = block_of_row[best_row]
+    return out
+
+
+@njit(parallel=True, cache=True)
+def _successors(states, block_of_row, rows, offsets, successor, conflict):
+    # successor[i,k]: column at field i continuing column k of field i-1, both in eigh order.
+    # Each step only compares columns within one M_F block, over that block's rows.
+    n_b, n_s, n_k = states.shape
+    n_blocks = len(offsets) - 1
+    for i in prange(1, n_b):
+        previous_blocks = _column_blocks(states[i-1], block_of_row)
+        current_blocks = _column_blocks(states[i], block_of_row)
+        taken = np.zeros(n_k, dtype=np.bool_)
+        for bi in range(n_blocks):
+            previous_cols = np.flatnonzero(previous_blocks == bi)
+            current_cols = np.flatnonzero(current_blocks == bi)
+            if len(previous_cols) != len(current_cols):
+                conflict[i] = True
+                continue
+            block_rows = rows[offsets[bi]:offsets[bi+1]]
+            previous = np.empty((len(block_rows), len(previous_cols)), dtype=states.dtype)
+            current = np.empty((len(block_rows), len(current_cols)), dtype=states.dtype)
+            for ri, r in enumerate(block_rows):
+                for ci, c in enumerate(previous_cols):
+                    previous[ri, ci] = states[i-1, r, c]
+                for ci, c in enumerate(current_cols):
+                    current[ri, ci] = states[i, r, c]
+            overlaps = np.abs(np.dot(np.conj(previous).T.copy(), current))
+            for ki, k in enumerate(previous_cols):
+                best_l = current_cols[np.argmax(overlaps[ki])]
+                if taken[best_l]:
+                    conflict[i] = True
+                taken[best_l] = True
+                successor[i, k] = best_l
+
+
+def track_states(energies, states, blocks=None):
+    """Reorder eigenpairs so that each column follows one state adiabatically.
+
+    Drop-in replacement for `calculate.sort_smooth`. The step-to-step overlaps
+    only involve columns of the same M_F block, and the assignment between
+    consecutive fields is computed for all fields in parallel before the
+    permutations are chained together. Where the largest overlaps do not form
+    a permutation (ties, or a step too coarse for the mixing), that field is
+    resolved with a full linear assignment instead of duplicating a column.
+
+    Args:
+        energies (numpy.ndarray): B x K eigenenergies, as from numpy.linalg.eigh
+        states (numpy.ndarray): B x S x K eigenvectors, in the same order as energies
+        blocks (list of numpy.ndarray): basis indices of each conserved block, e.g. from
+            `eigen.mf_blocks`; the whole basis is one block if None
+    Returns:
+        energies (numpy.ndarray): B x K eigenenergies, reordered in place
+        states (numpy.ndarray): B x S x K eigenvectors, reordered in place; row 0 is left as given
+    """
+    n_b, n_s, n_k = states.shape
+    if blocks is None:
+        blocks = [np.arange(n_s)]
+    block_of_row, rows, offsets = block_layout(blocks, n_s)
+
+    successor = np.tile(np.arange(n_k), (n_b, 1))
+    conflict = np.zeros(n_b, dtype=np.bool_)
+    _successors(states, block_of_row, rows, offsets, successor, conflict)
+    for i in np.flatnonzero(conflict):
+        overlaps = np.abs(states[i-1].conj().T @ states[i])
+        _, successor[i] = linear_sum_assignment(-overlaps)
+
+    order = np.arange(n_k)
+    for i in range(1, n_b):
+        order = successor[i][order]
+        energies[i] = energies[i][order]
+        states[i] = states[i][:, order]
+    return energies, states
@@ -0,0 +1,111 @@
+import types
+import numpy as np
+import scipy.constants
+from numba import njit, prange
+
+H_BAR = scipy.constants.hbar
+
+# A transition never restricts its own gate time
+SELF_DETUNING = 1e15
+
+
+def _transition_tables(energies, couplings, labels_d, edge_indices, edge_jump_list, t_g_unpol, t_g_pol, omegas):
+    n_b = energies.shape[1]
+    for e in prange(len(edge_indices)):
+        from_node = edge_indices[e, 0]
+        to_node = edge_indices[e, 1]
+        for b in range(n_b):
+            omegas[e, b] = abs(energies[from_node, b] - energies[to_node, b])/H_BAR
+
+        # Gate times are worked out going up in N
+        if labels_d[from_node, 0] > labels_d[to_node, 0]:
+            from_node, to_node = to_node, from_node
+        dmf_d = labels_d[to_node, 1] - labels_d[from_node, 1]
+        if dmf_d == 0:
+            section = 0
+        elif dmf_d == -2:
+            section = 1
+        else:
+            section = 2
+        from_neighbours = edge_jump_list[from_node]
+        to_neighbours = edge_jump_list[to_node]
+        specific = from_neighbours[section] + labels_d[to_node, 2]
+
+        # Off-resonant coupling out of the lower state to every upper state...
+        for k in range(from_neighbours[0], from_neighbours[3]):
+            other = edge_indices[k, 1]
+            pol = from_neighbours[section] <= k < from_neighbours[section+1]
+            for b in range(n_b):
+                delta = abs(energies[other, b] - energies[to_node, b])/H_BAR
+                if other == to_node:
+                    delta += SELF_DETUNING
+                g = abs(couplings[k, b]/couplings[specific, b])
+                r = (4*g**2 + g**4)/delta**2
+                t_g_unpol[e, b] += r
+                if pol:
+                    t_g_pol[e, b] += r
+        # ...and out of the upper state to every lower state
+        for k in range(to_neighbours[3], to_neighbours[6]):
+            other = edge_indices[k, 1]
+            pol = to_neighbours[section+3] <= k < to_neighbours[section+4]
+            for b in range(n_b):
+                delta = abs(energies[other, b] - energies[from_node, b])/H_BAR
+                if other == from_node:
+                    delta += SELF_DETUNING
+                g = abs(couplings[k, b]/couplings[specific, b])
+                r = (4*g**2 + g**4)/delta**2
+                t_g_unpol[e, b] += r
+                if pol:
+                    t_g_pol[e, b] += r
+
+        for b in range(n_b):
+            t_g_unpol[e, b] = np.pi*np.sqrt(t_g_unpol[e, b])/4
+            t_g_pol[e, b] = np.pi*np.sqrt(t_g_pol[e, b])/4
+
+
+def _build(parallel):
+    # numba's on-disk cache is keyed by the function's name, not its options, so each build gets its own
+    name = '_transition_tables_parallel' if parallel else '_transition_tables_serial'
+    kernel = types.FunctionType(_transition_tables.__code__, _transition_tables.__globals__, name)
+    kernel.__qualname__ = name
+    return njit(parallel=parallel, error_model='numpy', cache=True)(kernel)
+
+
+_transition_tables_parallel = _build(True)
+_transition_tables_serial = _build(False)
+
+
+def transition_tables(energies, couplings, labels_d, edge_indices, edge_jump_list, parallel=True,
+                      t_g_unpol=None, t_g_pol=None, omegas=None):
+    """Gate times and resonance frequencies of every edge at every field, in one pass.
+
+    The gate time of an edge is limited by off-resonant driving of every other
+    transition out of either of its two states; the polarised gate time only
+    counts those sharing the edge's polarisation. Each edge sums over its
+    neighbours' contiguous edge_jump_list segments.
+
+    Args:
+        energies (numpy.ndarray): S x B energies in canonical order
+        couplings (numpy.ndarray): E x B edge transition dipole moments
+        labels_d (numpy.ndarray): S x 3 canonical (N, MF_D, d) labels
+        edge_indices (numpy.ndarray): E x 2 (from, to) state indices
+        edge_jump_list (numpy.ndarray): S x 7 section start indices of each state's edges
+        parallel (bool): spread the edges over all cores
+        t_g_unpol, t_g_pol, omegas (numpy.ndarray): optional E x B arrays to write into
+    Returns:
+        t_g_unpol (numpy.ndarray): E x B unpolarised gate times
+        t_g_pol (numpy.ndarray): E x B polarised gate times
+        omegas (numpy.ndarray): E x B angular resonance frequencies
+    """
+    outputs = []
+    for out in (t_g_unpol, t_g_pol, omegas):
+        if out is None:
+            out = np.zeros(couplings.shape, dtype=np.double)
+        else:
+            out[...] = 0
+        outputs.append(out)
+
+    kernel = _transition_tables_parallel if parallel else _transition_tables_serial
+    kernel(np.ascontiguousarray(energies), np.ascontiguousarray(couplings), np.ascontiguousarray(labels_d),
+           np.ascontiguousarray(edge_indices), np.ascontiguousarray(edge_jump_list), *outputs)
+    return tuple(outputs)
@@ -29,6 +29,11 @@ from scipy.special import sph_harm
 
 from sympy.physics.wigner import wigner_3j
 
+import sys
+sys.path.append('../scripts')
+from precompute_tools.eigen import lowest_eigh
+from precompute_tools.tracking import track_states
+
 import matplotlib.pyplot as plt
 from matplotlib.pyplot import cm
 import matplotlib.gridspec as gridspec
@@ -213,48 +218,10 @@ energies, states = eigh(Htot)
 The `eigh` function sorts the states by increasing energy and so will rearange order of vectors
 """
 
-
 # %%
-def sort_smooth(in_energies, in_states):
-    """Sort states to remove false avoided crossings.
-
-    This is a function to ensure that all eigenstates plotted change
-    adiabatically, it does this by assuming that step to step the eigenstates
-    should vary by only a small amount (i.e. that the  step size is fine) and
-    arranging states to maximise the overlap one step to the next.
-
-    Args:
-        Energy (numpy.ndarray) : numpy.ndarray containing the eigenergies, as from numpy.linalg.eig
-        States (numpy.ndarray): numpy.ndarray containing the states, in the same order as Energy
-    Returns:
-        Energy (numpy.ndarray) : numpy.ndarray containing the eigenergies, as from numpy.linalg.eig
-        States (numpy.ndarray): numpy.ndarray containing the states, in the same order as Energy E[x,i] -> States[x,:,i]
-    """
-    ls = np.arange(in_states.shape[2], dtype="int")
-    number_iterations = len(in_energies[:, 0])
-    for i in range(1, number_iterations):
-        """
-        This loop sorts the eigenstates such that they maintain some
-        continuity. Each eigenstate should be chosen to maximise the overlap
-        with the previous.
-        """
-        # calculate the overlap of the ith and jth eigenstates
-        overlaps = np.einsum(
-            "ij,ik->jk", np.conjugate(in_states[i - 1, :, :]), in_states[i, :, :]
-        )
-        orig2 = in_states[i, :, :].copy()
-        orig1 = in_energies[i, :].copy()
-        # insert location of maximums into array ls
-        np.argmax(np.abs(overlaps), axis=1, out=ls)
-        for k in range(in_states.shape[2]):
-            l = ls[k]
-            if l != k:
-                in_energies[i, k] = orig1[l].copy()
-                in_states[i, :, k] = orig2[:, l].copy()
-    return in_energies, in_states
-
-
-energies, states = sort_smooth(energies, states)
+# M is conserved by the DC field, so states are only tracked within blocks of equal M
+M_BLOCKS = [np.array([i for i, N, M in state_iter(N_MAX) if M == m]) for m in range(-N_MAX, N_MAX+1)]
+energies, states = track_states(energies, states, M_BLOCKS)
 
 # %% [markdown]
 """
@@ -625,7 +592,8 @@ for N in range(1, N_MAX + 1):
     size = 1 + 2 * N + N**2
     convergence_Htot = Hrot[:size, :size, None] + Hdc[:size, :size, None] * E
     convergence_Htot = convergence_Htot.transpose(2, 0, 1)
-    convergence_energies, convergence_states = eigh(convergence_Htot)
+    # Only the ground state is needed, so skip the rest of the spectrum
+    convergence_energies, convergence_states = lowest_eigh(convergence_Htot, 1)
     convergence_dipoles = -np.gradient(convergence_energies[:, 0], E) / D_0
     converged_dipoles.append(convergence_dipoles[-2])
 
@@ -41,6 +41,12 @@ from tqdm import tqdm, trange
 import math
 import itertools
 
+import sys
+sys.path.append('../scripts')
+from precompute_tools.cache import cached_store
+from precompute_tools.blocks import load_states
+from precompute_tools.state_index import state_index_from_store, degeneracy, node_index, edge_index
+
 from numba import jit, njit
 from numba import njit
 from numba_progress import ProgressBar
@@ -92,7 +98,7 @@ GAUSS = 1e-4 # T
 
 # %%
 print("Loading precomputed data...")
-data = np.load(f'../precomputed/{settings_string}.npz')
+data = cached_store(MOLECULE_STRING, N_MAX) # computed on first use
 
 B=data['b']
 B_MIN = B[0]
@@ -100,7 +106,7 @@ B_MAX = B[-1]
 B_STEPS = len(B)
 
 ENERGIES = data['energies']
-STATES = data['states']
+STATES = load_states(data) # dense or block-sparse, STATES[b] is always dense
 
 UNCOUPLED_LABELS_D=data['uncoupled_labels_d']
 
@@ -127,12 +133,14 @@ PREDECESSOR_UNPOL = data['predecessor_unpol_time_from_initials']
 
 PAIR_RESONANCE = data['pair_resonance']
 
+STATE_INDEX = state_index_from_store(data)
+
 def label_degeneracy(N,MF_D):
-    return LABELS_DEGENERACY[N,(MF_D+F_D_MAX)//2]
+    return degeneracy(STATE_INDEX, N, MF_D)
 
 @jit(nopython=True)
 def label_d_to_node_index(N,MF_D,d):
-    return STATE_JUMP_LIST[N,(MF_D+F_D_MAX)//2]+d
+    return node_index(STATE_INDEX, N, MF_D, d)
 
 @jit(nopython=True)
 def label_d_to_edge_indices(N,MF_D,d): # Returns the start indices of P=0,P=1,P=2, and the next edge
@@ -221,9 +229,7 @@ def field_to_bi(gauss):
 # %%
 @jit(nopython=True)
 def label_pair_to_edge_index(label1,label2):
-    first_indices = label_d_to_edge_indices(label1[0],label1[1],label1[2])
-    section = 3*((label2[0] - label1[0]) < 0) + [0,1,2][(label2[0] - label1[0])*(label1[1] - label2[1])//2]
-    return first_indices[section]+label2[2]
+    return edge_index(STATE_INDEX, label1, label2)
 
 # TRANSITION_LABELS_D[label_pair_to_edge_index((1,4,3),(0,2,1))]
 # TRANSITION_LABELS_D[label_pair_to_edge_index(np.array([1,4,3]),np.array([0,2,1]))]